@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+#Representações internas da matriz de abundâncias
+MATRIX_FORMAT_SPARSE = "sparse"
+MATRIX_FORMAT_DENSE = "dense"
+MATRIX_FORMATS = (MATRIX_FORMAT_SPARSE, MATRIX_FORMAT_DENSE)
+
+
+class AbundanceMatrix:
+    """
+    Matriz de abundâncias (amostras x espécies) com índice de espécies fixo.
+    Os valores ficam em uma matriz CSR (float32), que guarda apenas as entradas não nulas, ou em um array denso float32.
+    Espécies ausentes em um arquivo são simplesmente zeros, sem cópias intermediárias (reindex/concat/fillna).
+    """
+
+    def __init__(self, values, species):
+        self.values = values
+        self.species = list(species)
+
+    @classmethod
+    def from_frame(cls, df, species, matrix_format=MATRIX_FORMAT_SPARSE, dtype=np.float32):
+        """Monta a matriz a partir das colunas `species` de um DataFrame, coluna a coluna. NaN e colunas ausentes viram zero."""
+        if matrix_format not in MATRIX_FORMATS: raise ValueError(f"Formato de matriz desconhecido: {matrix_format}")
+        n_samples = len(df)
+        columns = [(position, name) for position, name in enumerate(species) if name in df.columns]
+        if matrix_format == MATRIX_FORMAT_DENSE:
+            values = np.zeros((n_samples, len(species)), dtype=dtype)
+            for position, name in columns:
+                values[:, position] = df[name].to_numpy(dtype=dtype, na_value=0)
+            return cls(values, species)
+        rows, cols, data = [], [], []
+        for position, name in columns:
+            column = df[name].to_numpy(dtype=dtype, na_value=0)
+            nonzero = np.flatnonzero(column)
+            rows.append(nonzero)
+            cols.append(np.full(len(nonzero), position, dtype=np.int32))
+            data.append(column[nonzero])
+        if not columns: rows, cols, data = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int32)], [np.empty(0, dtype=dtype)]
+        values = sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                                   shape=(n_samples, len(species)), dtype=dtype)
+        return cls(values, species)
+
+    @classmethod
+    def vstack(cls, matrices):
+        """Empilha matrizes com o mesmo índice de espécies (ex.: todas as amostras alvo de uma análise)."""
+        species = matrices[0].species
+        if any(matrix.species != species for matrix in matrices): raise ValueError("Matrizes com índices de espécies diferentes.")
+        if all(matrix.is_sparse for matrix in matrices):
+            return cls(sparse.vstack([matrix.values for matrix in matrices], format='csr'), species)
+        return cls(np.vstack([matrix.to_dense() for matrix in matrices]), species)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def is_sparse(self):
+        return sparse.issparse(self.values)
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def to_dense(self):
+        return self.values.toarray() if self.is_sparse else self.values
+
+    def row_sums(self):
+        return np.asarray(self.values.sum(axis=1, dtype=float)).ravel()
+
+    def top_n(self, n):
+        """
+        As `n` espécies mais abundantes de cada amostra, em ordem decrescente (empates pela ordem das colunas,
+        como no `nlargest` do pandas). Retorna uma pd.Series (espécie -> abundância) por amostra.
+        """
+        results = []
+        for row in range(len(self)):
+            if self.is_sparse:
+                start, end = self.values.indptr[row], self.values.indptr[row + 1]
+                cols, vals = self.values.indices[start:end], self.values.data[start:end]
+                positive = vals > 0
+                cols, vals = cols[positive], vals[positive]
+                order = np.lexsort((cols, -vals))[:n]
+                cols, vals = cols[order], vals[order]
+                #Amostras com menos de n espécies presentes são completadas com espécies zeradas (mesma saída do modo denso)
+                if len(cols) < n:
+                    missing = np.setdiff1d(np.arange(len(self.species)), cols, assume_unique=True)[:n - len(cols)]
+                    cols, vals = np.concatenate([cols, missing]), np.concatenate([vals, np.zeros(len(missing), dtype=vals.dtype)])
+            else:
+                row_values = self.values[row]
+                cols = np.argsort(-row_values, kind='stable')[:n]
+                vals = row_values[cols]
+            results.append(pd.Series(vals, index=[self.species[col] for col in cols]))
+        return results
+
+
+#Bray-Curtis entre as linhas de duas matrizes de abundâncias não negativas: soma(|u - v|) / (soma(u) + soma(v)).
+#A distância de Manhattan do scikit-learn opera diretamente sobre matrizes CSR, sem densificar as entradas.
+def bray_curtis_distances(x, y=None):
+    from sklearn.metrics.pairwise import manhattan_distances
+    y = x if y is None else y
+    #As somas e distâncias são acumuladas em float64, como no scipy
+    x_values = (x.values if isinstance(x, AbundanceMatrix) else x).astype(float)
+    y_values = x_values if y is x else (y.values if isinstance(y, AbundanceMatrix) else y).astype(float)
+    if sparse.issparse(x_values) != sparse.issparse(y_values):
+        x_values, y_values = sparse.csr_matrix(x_values), sparse.csr_matrix(y_values)
+    x_sums = np.asarray(x_values.sum(axis=1)).ravel()
+    y_sums = np.asarray(y_values.sum(axis=1)).ravel()
+    distances = manhattan_distances(x_values, y_values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return distances / (x_sums[:, None] + y_sums[None, :])
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+#Métricas de diversidade alfa disponíveis, todas calculadas em uma única passada sobre a matriz de abundâncias
+ALPHA_DIVERSITY_METRICS = ["shannon", "simpson", "inverse_simpson", "observed", "pielou", "chao1"]
+
+
+#Extrai apenas as entradas positivas da matriz (valor e linha de cada uma). Zeros e NaN não contribuem para nenhuma métrica,
+#então nenhuma cópia densa com eps é necessária e matrizes esparsas são tratadas sem densificação.
+def _positive_entries(abundances):
+    if sparse.issparse(abundances):
+        matrix = sparse.csr_matrix(abundances)
+        rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+        values = np.asarray(matrix.data, dtype=float)
+    else:
+        matrix = np.asarray(abundances, dtype=float)
+        if matrix.ndim == 1: matrix = matrix[None, :]
+        rows, cols = np.nonzero(matrix > 0)
+        values = matrix[rows, cols]
+    keep = values > 0
+    return values[keep], rows[keep], matrix.shape[0]
+
+
+def calculate_alpha_diversity(abundances, metrics=None):
+    """
+    Calcula as métricas de diversidade alfa para cada amostra (linha) de uma matriz de abundâncias.
+    Aceita DataFrame, array NumPy ou matriz esparsa do SciPy e retorna um DataFrame com uma coluna por métrica.
+    O Chao1 considera singletons/doubletons como abundâncias exatamente iguais a 1 e 2 (contagens brutas); para
+    abundâncias relativas ele coincide com a riqueza observada.
+    """
+    metrics = list(metrics or ALPHA_DIVERSITY_METRICS)
+    unknown = [metric for metric in metrics if metric not in ALPHA_DIVERSITY_METRICS]
+    if unknown: raise ValueError(f"Métricas de diversidade alfa desconhecidas: {', '.join(unknown)}")
+
+    index = None
+    if isinstance(abundances, pd.DataFrame):
+        index = abundances.index
+        abundances = abundances.to_numpy(dtype=float, na_value=0.0)
+    values, rows, n_samples = _positive_entries(abundances)
+
+    totals = np.bincount(rows, weights=values, minlength=n_samples)
+    proportions = values / totals[rows]
+    observed = np.bincount(rows, minlength=n_samples).astype(float)
+    shannon = np.bincount(rows, weights=-proportions * np.log(proportions), minlength=n_samples)
+    sum_squares = np.bincount(rows, weights=proportions ** 2, minlength=n_samples)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        results = {
+            "shannon": shannon,
+            "simpson": np.where(observed > 0, 1.0 - sum_squares, 0.0),
+            "inverse_simpson": np.where(sum_squares > 0, 1.0 / sum_squares, 0.0),
+            "observed": observed,
+            "pielou": np.where(observed > 1, shannon / np.log(observed), np.nan),
+        }
+    if "chao1" in metrics:
+        singletons = np.bincount(rows, weights=(values == 1), minlength=n_samples)
+        doubletons = np.bincount(rows, weights=(values == 2), minlength=n_samples)
+        results["chao1"] = observed + singletons * (singletons - 1) / (2 * (doubletons + 1))
+
+    return pd.DataFrame({metric: results[metric] for metric in metrics}, index=index)
+
+
+#Resumo (média e desvio padrão amostral) de cada métrica, usado como valor de referência no laudo
+def summarize_alpha_diversity(alpha_diversities):
+    return {metric: {"mean": float(np.nanmean(values)), "std": float(pd.Series(values).std())}
+            for metric, values in alpha_diversities.items()}
@@ -0,0 +1,401 @@
+import pandas as pd
+import numpy as np
+import os
+import time
+import json
+from datetime import datetime
+from abundance import MATRIX_FORMATS, AbundanceMatrix
+from alpha_diversity import ALPHA_DIVERSITY_METRICS, calculate_alpha_diversity, summarize_alpha_diversity
+from insight_cache import InsightCache
+from ingestion import read_table
+from insights import InsightPipeline
+from metrics import ANALYSES, MODEL_REGISTRY_LOOKUPS, SAMPLES, AnalysisTimer, observe_stage, registry as metrics_registry
+from model_registry import ModelRegistry, compute_reference_fingerprint
+from plots import PLOT_FORMAT_DATA, PLOT_FORMATS, PlotRenderer, top_bacteria_plot_data, warm_up_fonts
+from result_stream import RECORD_ANALYSIS, RECORD_SAMPLE, RECORD_SUMMARY
+
+# Variáveis alvo que o modelo irá predizer
+TARGET_VARIABLES = ["age_months", "body_weight"] 
+
+#Configurações padrão do pipeline de análise (podem ser sobrescritas pelo app.config do Flask)
+DEFAULT_SETTINGS = {
+    'UPLOAD_FOLDER': 'uploads',
+    'MODEL_CACHE_FOLDER': 'model_cache',
+    'MODEL_REGISTRY_MAX_IN_MEMORY': 2,
+    #Métricas de diversidade alfa exportadas no JSON/laudo (todas são calculadas juntas; a lista apenas filtra a saída)
+    'ALPHA_DIVERSITY_METRICS': list(ALPHA_DIVERSITY_METRICS),
+    #Etapa concorrente de insights (Gemini + PubMed)
+    'INSIGHT_MAX_WORKERS': 8,
+    'INSIGHT_CALL_TIMEOUT': 60,
+    #Cache dos insights por conjunto de bactérias dominantes (memória LRU + SQLite em disco)
+    'INSIGHT_CACHE_PATH': os.path.join('insight_cache', 'insights.sqlite3'),
+    'INSIGHT_CACHE_TTL': 7 * 24 * 3600,
+    'INSIGHT_CACHE_MAX_IN_MEMORY': 1024,
+    #Gráficos: 'png' (padrão), 'svg' (vetorial, mais leve) ou 'data' (apenas os dados, desenhados no navegador)
+    'PLOT_FORMAT': 'png',
+    #Processos usados para renderizar os gráficos de lotes com várias amostras (0 ou 1 renderiza no próprio processo)
+    'PLOT_MAX_WORKERS': min(4, os.cpu_count() or 1),
+    #Amostras cujos gráficos são agendados juntos; limita as imagens em memória e o tempo até o primeiro resultado
+    'PLOT_BLOCK_SIZE': 16,
+    #Representação interna das abundâncias: 'sparse' (CSR float32, apenas valores não nulos) ou 'dense' (array float32)
+    'ABUNDANCE_MATRIX_FORMAT': 'sparse',
+    #Número de amostras da referência mais semelhantes (Bray-Curtis) listadas para cada amostra alvo (0 desativa)
+    'SIMILAR_SAMPLES_K': 5,
+    #Treinamento: núcleos usados pelas florestas e pelos folds (-1 = todos) e validação cruzada k-fold (0 = divisão única 80/20)
+    'TRAINING_N_JOBS': -1,
+    'TRAINING_CV_FOLDS': 0,
+}
+
+#Configurações que mudam o conteúdo do pacote de modelos e, portanto, fazem parte da sua impressão digital
+TRAINING_OPTION_KEYS = ('ABUNDANCE_MATRIX_FORMAT', 'TRAINING_CV_FOLDS')
+
+#Etapas reportadas ao callback de progresso
+STAGE_LOADING = "leitura"
+STAGE_TRAINING = "modelos"
+STAGE_PREDICTION = "predicao"
+STAGE_SAMPLES = "amostras"
+STAGE_SAVING = "salvando"
+
+settings = dict(DEFAULT_SETTINGS)
+model_registry = None
+insight_cache = None
+insight_pipeline = None
+plot_renderer = None
+
+
+class AnalysisError(Exception):
+    """Erro de validação/leitura que impede a análise; a mensagem é exibida ao usuário."""
+
+
+#Inicializa os serviços compartilhados do pipeline (registro de modelos e etapa de insights) a partir de uma configuração.
+#Deve ser chamada uma vez por processo (servidor Flask ou processo de trabalho da fila de análises).
+def init_analysis_services(config):
+    global model_registry, insight_cache, insight_pipeline, plot_renderer
+    settings.update({key: config[key] for key in DEFAULT_SETTINGS if key in config})
+    #Registro dos modelos treinados por base de referência (evita retreinar a cada requisição com a mesma referência)
+    model_registry = ModelRegistry(os.path.join(os.getcwd(), settings['MODEL_CACHE_FOLDER']),
+                                   max_in_memory=settings['MODEL_REGISTRY_MAX_IN_MEMORY'])
+    insight_cache = InsightCache(os.path.join(os.getcwd(), settings['INSIGHT_CACHE_PATH']),
+                                 ttl_seconds=settings['INSIGHT_CACHE_TTL'], max_in_memory=settings['INSIGHT_CACHE_MAX_IN_MEMORY'])
+    insight_pipeline = InsightPipeline(max_workers=settings['INSIGHT_MAX_WORKERS'], call_timeout=settings['INSIGHT_CALL_TIMEOUT'],
+                                       cache=insight_cache)
+    if settings['ABUNDANCE_MATRIX_FORMAT'] not in MATRIX_FORMATS: raise ValueError(f"ABUNDANCE_MATRIX_FORMAT inválido: {settings['ABUNDANCE_MATRIX_FORMAT']}")
+    if settings['TRAINING_CV_FOLDS'] == 1 or settings['TRAINING_CV_FOLDS'] < 0: raise ValueError("TRAINING_CV_FOLDS deve ser 0 ou pelo menos 2.")
+    if settings['PLOT_FORMAT'] not in PLOT_FORMATS: raise ValueError(f"PLOT_FORMAT inválido: {settings['PLOT_FORMAT']}")
+    unknown_metrics = [metric for metric in settings['ALPHA_DIVERSITY_METRICS'] if metric not in ALPHA_DIVERSITY_METRICS]
+    if unknown_metrics: raise ValueError(f"ALPHA_DIVERSITY_METRICS contém métricas desconhecidas: {', '.join(unknown_metrics)}")
+    if plot_renderer is not None: plot_renderer.shutdown()
+    plot_renderer = PlotRenderer(max_workers=settings['PLOT_MAX_WORKERS'])
+    metrics_registry.set_collector("insight_cache", _insight_cache_metrics)
+
+#Aquecimento opcional do processo, antes da primeira requisição: pacotes de modelos mais recentes do disco
+#(o que também importa o scikit-learn) e fontes/backend do matplotlib
+def warm_up_analysis_services():
+    start = time.perf_counter()
+    loaded = model_registry.preload()
+    if settings['PLOT_FORMAT'] != PLOT_FORMAT_DATA: warm_up_fonts()
+    elapsed = time.perf_counter() - start
+    observe_stage("warm_up", elapsed)
+    print(f"DEBUG: Aquecimento concluído em {elapsed:.2f}s ({loaded} referência(s) em memória)")
+
+def training_options():
+    return {key: settings[key] for key in TRAINING_OPTION_KEYS}
+
+#Contadores do cache de insights expostos no /metrics
+def _insight_cache_metrics():
+    stats = insight_cache.stats()
+    help_text = "Consultas ao cache de insights, por resultado."
+    return [("microbiota_insight_cache_lookups_total", "counter", help_text, {"result": "memory_hit"}, stats["memory_hits"]),
+            ("microbiota_insight_cache_lookups_total", "counter", help_text, {"result": "disk_hit"}, stats["disk_hits"]),
+            ("microbiota_insight_cache_lookups_total", "counter", help_text, {"result": "miss"}, stats["misses"]),
+            ("microbiota_insight_cache_entries", "gauge", "Insights mantidos em memória.", {}, stats["in_memory"])]
+
+#Carregamento dos arquivos (documentos alvo e referencia fornecidos). As colunas de espécie são lidas como float32;
+#metas, idade microbiana e identificadores de amostra mantêm os tipos inferidos.
+def load_data_from_memory(file_storage, required_columns=()):
+    return read_table(file_storage, required_columns=required_columns,
+                      metadata_columns=set(TARGET_VARIABLES + ["age_months", "microbial_age"] + SAMPLE_ID_COLUMNS))
+
+#Exporta os resultados principais dos arquivos de referência e arquivos alvo (idade e peso predito, índice de shannon, MAZ para serem lidos posteriormente)
+#Retorna o caminho do arquivo gerado (ou None em caso de falha). O sufixo opcional evita colisões entre análises simultâneas.
+def save_results_to_json(data, suffix=None):
+    upload_folder = os.path.join(os.getcwd(), settings['UPLOAD_FOLDER'])
+    if not os.path.exists(upload_folder): os.makedirs(upload_folder)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"analysis_results_{timestamp}_{suffix}.json" if suffix else f"analysis_results_{timestamp}.json"
+    filepath = os.path.join(upload_folder, filename)
+    try:
+        start = time.perf_counter()
+        with open(filepath, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        observe_stage("json_save", time.perf_counter() - start)
+        print(f"Resultados salvos com sucesso em: {filepath}")
+        return filepath
+    except Exception as e:
+        print(f"ERRO: Falha ao salvar o arquivo JSON: {e}")
+        return None
+
+#Colunas usadas para identificar cada amostra quando um arquivo alvo contém várias linhas
+SAMPLE_ID_COLUMNS = ["sample_id", "Unnamed: 0"]
+
+#Colunas de espécie da referência: todas, exceto as variáveis alvo, a idade microbiana e os identificadores de amostra
+def reference_species_columns(reference_db):
+    excluded = set(TARGET_VARIABLES + ['microbial_age'] + SAMPLE_ID_COLUMNS)
+    return [col for col in reference_db.columns if col not in excluded]
+
+#Nome de cada amostra de um arquivo alvo. Arquivos com uma única linha mantêm o nome do arquivo
+def build_sample_names(filename, target_sample):
+    if len(target_sample) == 1: return [filename]
+    id_column = next((col for col in SAMPLE_ID_COLUMNS if col in target_sample.columns), None)
+    sample_ids = target_sample[id_column].astype(str).tolist() if id_column else range(1, len(target_sample) + 1)
+    return [f"{filename} [{sample_id}]" for sample_id in sample_ids]
+
+#Treinamento dos modelos e estatísticas da referência. O resultado é armazenado no registro de modelos,
+#portanto só é executado quando a base de referência (conteúdo + colunas de espécie) ainda não foi vista.
+#O scikit-learn e os módulos de ordenação/vizinhos só são importados aqui (ou ao carregar um pacote salvo), e não na inicialização.
+def train_reference_bundle(reference_db, species_columns):
+    from beta_diversity import ReferenceOrdination
+    from neighbors import ReferenceNeighbors
+    from training import train_models
+    X_ref = AbundanceMatrix.from_frame(reference_db, species_columns, settings['ABUNDANCE_MATRIX_FORMAT'])
+    #Uma floresta multi-saída para todas as variáveis alvo, avaliada por holdout ou k-fold e treinada com toda a referência.
+    #A idade microbiana é a própria predição de idade desse modelo (não há mais um segundo modelo de idade).
+    models, performance_metrics = train_models(X_ref.values, reference_db[TARGET_VARIABLES].to_numpy(dtype=float), TARGET_VARIABLES,
+                                               n_jobs=settings['TRAINING_N_JOBS'], cv_folds=settings['TRAINING_CV_FOLDS'])
+    predicted_microbial_ages_ref = models.predict(X_ref.values)["age_months"]
+    mediana_microbiana_ref = np.median(predicted_microbial_ages_ref)
+    desvio_padrao_microbiano_ref = np.std(predicted_microbial_ages_ref)
+    #Diversidade alfa da referência (todas as métricas em uma única passada)
+    reference_alpha_diversity = summarize_alpha_diversity(calculate_alpha_diversity(X_ref.values))
+    #Ordenação PCoA (Bray-Curtis) da referência, calculada uma única vez e reutilizada para projetar cada amostra alvo
+    try:
+        ordination = ReferenceOrdination(X_ref)
+    except Exception as e:
+        print(f"ERRO AO CALCULAR A PCoA DA REFERÊNCIA: {e}")
+        ordination = None
+    #Índice de vizinhos (Bray-Curtis) da referência para a busca de perfis semelhantes
+    id_column = next((col for col in SAMPLE_ID_COLUMNS if col in reference_db.columns), None)
+    try:
+        neighbors = ReferenceNeighbors(X_ref, reference_db["age_months"], reference_db["body_weight"],
+                                       sample_ids=reference_db[id_column].astype(str).tolist() if id_column else None)
+    except Exception as e:
+        print(f"ERRO AO CONSTRUIR O ÍNDICE DE VIZINHOS DA REFERÊNCIA: {e}")
+        neighbors = None
+    return {
+        "species_columns": list(species_columns),
+        "models": models,
+        "performance_metrics": performance_metrics,
+        "microbial_age_median": mediana_microbiana_ref,
+        "microbial_age_std": desvio_padrao_microbiano_ref,
+        "reference_alpha_diversity": reference_alpha_diversity,
+        "ordination": ordination,
+        "neighbors": neighbors,
+    }
+
+#Pipeline completo de análise: treinamento (ou recuperação dos modelos), predição em lote, gráficos e insights.
+#`reference_file` e `target_files` seguem a interface do FileStorage do Werkzeug (atributos filename, stream e read()).
+#`progress(etapa, fracao)` é chamado ao longo da execução, permitindo acompanhar análises em segundo plano.
+#Os tempos de cada etapa são incorporados ao resultado em "timings" e alimentam as métricas do processo (/metrics).
+def run_analysis(reference_file, target_files, progress=None, plot_format=None):
+    final_results = None
+    for record_type, payload in iter_analysis(reference_file, target_files, progress, plot_format):
+        if record_type == RECORD_ANALYSIS:
+            final_results = dict(payload, individual_analyses=[])
+        elif record_type == RECORD_SAMPLE:
+            final_results["individual_analyses"].append(payload)
+        elif record_type == RECORD_SUMMARY:
+            final_results["timings"] = payload["timings"]
+    return final_results
+
+#Mesma análise de run_analysis, produzida como uma sequência de registros (tipo, campos): o cabeçalho da análise (referência e
+#desempenho dos modelos), um registro por amostra, na ordem de envio, assim que seus gráficos e insight ficam prontos, e o resumo
+#com os tempos. Erros de validação (AnalysisError) são lançados na própria chamada, antes do primeiro registro.
+def iter_analysis(reference_file, target_files, progress=None, plot_format=None):
+    timer = AnalysisTimer()
+    progress = progress or (lambda stage, fraction: None)
+    try:
+        context = _prepare_analysis(reference_file, progress, plot_format, timer)
+    except AnalysisError:
+        metrics_registry.inc(ANALYSES, status="invalid")
+        raise
+    except Exception:
+        metrics_registry.inc(ANALYSES, status="error")
+        raise
+    return _analysis_records(context, target_files, progress, timer)
+
+#Leitura e validação da referência e recuperação (ou treinamento) do pacote de modelos
+def _prepare_analysis(reference_file, progress, plot_format, timer):
+    plot_format = plot_format or settings['PLOT_FORMAT']
+    if plot_format not in PLOT_FORMATS: raise AnalysisError(f"Formato de gráfico inválido: {plot_format}")
+    progress(STAGE_LOADING, 0.0)
+    #As colunas obrigatórias são validadas pelo cabeçalho, antes da leitura completa da referência
+    with timer.stage("load_reference"):
+        reference_db, error = load_data_from_memory(reference_file, required_columns=TARGET_VARIABLES + ["age_months"])
+    if error: raise AnalysisError(f"Erro ao carregar a base de referência: {error}")
+    species_columns = reference_species_columns(reference_db)
+    if not species_columns: raise AnalysisError("Nenhuma coluna de espécie identificada na base de referência.")
+    if len(reference_db) < 2: raise AnalysisError("Base de referência precisa de ao menos 2 amostras.")
+    with timer.stage("fingerprint"):
+        fingerprint = compute_reference_fingerprint(reference_file.stream, species_columns, training_options())
+    progress(STAGE_TRAINING, 0.1)
+    with timer.stage("model_lookup"):
+        bundle = model_registry.get(fingerprint)
+    metrics_registry.inc(MODEL_REGISTRY_LOOKUPS, result="hit" if bundle is not None else "miss")
+    if bundle is None:
+        with timer.stage("training"):
+            bundle = model_registry.get_or_train(fingerprint, lambda: train_reference_bundle(reference_db, species_columns))
+    return {"reference_filename": reference_file.filename, "ages_ref": reference_db['age_months'].to_numpy(dtype=float),
+            "species_columns": species_columns, "bundle": bundle, "plot_format": plot_format}
+
+def _analysis_records(context, target_files, progress, timer):
+    try:
+        yield from _run_analysis(context, target_files, progress, timer)
+    except GeneratorExit:
+        #Consumidor interrompido (ex.: cliente da API desconectou)
+        metrics_registry.inc(ANALYSES, status="aborted")
+        raise
+    except Exception:
+        metrics_registry.inc(ANALYSES, status="error")
+        raise
+    metrics_registry.inc(ANALYSES, status="ok")
+    yield RECORD_SUMMARY, {"timings": timer.as_dict()}
+
+def _run_analysis(context, target_files, progress, timer):
+    bundle, plot_format, ages_ref = context["bundle"], context["plot_format"], context["ages_ref"]
+    species_columns = context["species_columns"]
+    models = bundle["models"]
+    mediana_microbiana_ref = bundle["microbial_age_median"]
+    desvio_padrao_microbiano_ref = bundle["microbial_age_std"]
+    reference_alpha_diversity = bundle["reference_alpha_diversity"]
+    alpha_metrics = settings['ALPHA_DIVERSITY_METRICS']
+    ordination = bundle["ordination"]
+    neighbors = bundle["neighbors"]
+
+    #  cabeçalho do JSON (dados da referência e dos modelos), enviado antes das amostras
+    header = {
+        "analysis_timestamp": datetime.now().isoformat(),
+        "reference_file": context["reference_filename"],
+        "model_performance": bundle["performance_metrics"],
+        "reference_alpha_diversity": {"mean": reference_alpha_diversity["shannon"]["mean"], "std": reference_alpha_diversity["shannon"]["std"],
+                                      "metrics": {metric: reference_alpha_diversity[metric] for metric in alpha_metrics}},
+        "reference_maz_mean": 0.0,
+        "plot_format": plot_format,
+    }
+    #No modo 'data' as coordenadas da referência na PCoA são exportadas uma única vez para todas as amostras
+    if plot_format == PLOT_FORMAT_DATA and ordination is not None:
+        header["reference_pcoa"] = {"x": ordination.coordinates[:, 0].tolist(), "y": ordination.coordinates[:, 1].tolist(),
+                                    "age": ages_ref.tolist()}
+    yield RECORD_ANALYSIS, header
+
+    progress(STAGE_PREDICTION, 0.3)
+    #Leitura de todos os arquivos alvo. Arquivos com várias linhas (ex.: placas de 96 amostras) geram uma amostra por linha,
+    #e todas as amostras são alinhadas em uma única matriz para que cada modelo faça uma só predição para o lote inteiro.
+    #`entries` guarda apenas o nome de cada amostra (ou o erro do arquivo); os resultados são produzidos um a um.
+    entries, target_matrices, real_frames, batch_positions = [], [], [], []
+    for target_file in target_files:
+        with timer.stage("load_targets"):
+            target_sample, error = load_data_from_memory(target_file)
+        if error:
+            entries.append({"filename": target_file.filename, "error": error})
+            continue
+        for sample_name in build_sample_names(target_file.filename, target_sample):
+            batch_positions.append(len(entries))
+            entries.append({"filename": sample_name})
+        with timer.stage("abundance_matrix"):
+            target_matrices.append(AbundanceMatrix.from_frame(target_sample, species_columns, settings['ABUNDANCE_MATRIX_FORMAT']))
+        real_frames.append(target_sample.reindex(columns=TARGET_VARIABLES))
+
+    if batch_positions:
+        target_batch = AbundanceMatrix.vstack(target_matrices)
+        real_values = pd.concat(real_frames, ignore_index=True)
+
+        metrics_registry.inc(SAMPLES, len(target_batch))
+
+        with timer.stage("prediction"):
+            predictions = models.predict(target_batch.values)
+        predicted_microbial_ages = predictions["age_months"]
+        if desvio_padrao_microbiano_ref > 0:
+            maz_values = (predicted_microbial_ages - mediana_microbiana_ref) / desvio_padrao_microbiano_ref
+        else:
+            maz_values = np.zeros(len(target_batch))
+        with timer.stage("alpha_diversity"):
+            alpha_diversities = calculate_alpha_diversity(target_batch.values)
+
+        #Todas as amostras do lote são projetadas de uma vez nos eixos fixos da PCoA da referência
+        batch_coords = None
+        if ordination is not None:
+            try:
+                with timer.stage("pcoa_projection"):
+                    batch_coords = ordination.project(target_batch)[:, :2]
+            except Exception as e:
+                print(f"ERRO AO PROJETAR AMOSTRAS NA PCoA: {e}")
+
+        #Amostras da referência mais parecidas com cada amostra alvo, consultadas em lote no índice de vizinhos
+        similar_samples = [[] for _ in batch_positions]
+        if neighbors is not None and settings['SIMILAR_SAMPLES_K'] > 0:
+            try:
+                with timer.stage("similar_samples"):
+                    similar_samples = neighbors.query(target_batch, k=settings['SIMILAR_SAMPLES_K'])
+            except Exception as e:
+                print(f"ERRO AO BUSCAR AMOSTRAS SEMELHANTES NA REFERÊNCIA: {e}")
+
+        #Os insights (chamadas de rede) de todas as amostras são disparados antes dos gráficos e rodam em paralelo com eles
+        with timer.stage("top_n"):
+            top_bacteria = target_batch.top_n(10)
+        insight_futures = [insight_pipeline.submit(entries[position]["filename"], top_bacteria[row].head(3).index.tolist())
+                           for row, position in enumerate(batch_positions)]
+
+        #Gráficos (barras + PCoA): no modo 'data' apenas os dados são exportados, sem renderização
+        reference_coords = ordination.coordinates[:, :2] if ordination is not None else None
+        plot_data = [{"top_bacteria": top_bacteria_plot_data(top_bacteria[row]),
+                      "pcoa": None if batch_coords is None else {"x": float(batch_coords[row, 0]), "y": float(batch_coords[row, 1]),
+                                                                 "age": float(predictions['age_months'][row])}}
+                     for row in range(len(batch_positions))]
+        #Os gráficos são renderizados em blocos de PLOT_BLOCK_SIZE amostras (o bloco seguinte é agendado enquanto o atual é
+        #entregue), de modo que a primeira amostra não espera o lote inteiro e apenas dois blocos de imagens ficam em memória
+        block_size = max(1, settings['PLOT_BLOCK_SIZE'])
+        plot_futures = []
+        def submit_plot_block(start):
+            plot_futures.extend(plot_renderer.submit([
+                {"sample_name": entries[batch_positions[row]]["filename"], "plot_format": plot_format,
+                 "top_bacteria": plot_data[row]["top_bacteria"], "reference_key": bundle["fingerprint"],
+                 "reference_coords": reference_coords, "ages_ref": ages_ref,
+                 "target_coords": None if batch_coords is None else batch_coords[row], "age_predicted": predictions['age_months'][row]}
+                for row in range(start, min(start + block_size, len(batch_positions)))]))
+        if plot_format != PLOT_FORMAT_DATA: submit_plot_block(0)
+
+    rows = {position: row for row, position in enumerate(batch_positions)}
+    for position, entry in enumerate(entries):
+        if position not in rows:
+            yield RECORD_SAMPLE, entry
+            continue
+        row = rows[position]
+        progress(STAGE_SAMPLES, 0.4 + 0.55 * row / len(batch_positions))
+        individual_result = dict(entry)
+        comparison_metrics = {}
+        for target in TARGET_VARIABLES:
+            real_value = real_values[target].iloc[row]
+            comparison_metrics[target] = { "real": None if pd.isna(real_value) else real_value, "predicted": predictions[target][row] }
+        individual_result["comparison_metrics"] = comparison_metrics
+        individual_result["maz_value"] = maz_values[row]
+        individual_result["alpha_diversity_value"] = alpha_diversities["shannon"].iloc[row]
+        individual_result["alpha_diversity"] = {metric: None if pd.isna(alpha_diversities[metric].iloc[row]) else float(alpha_diversities[metric].iloc[row])
+                                                for metric in alpha_metrics}
+        individual_result["similar_samples"] = similar_samples[row]
+
+        if plot_format == PLOT_FORMAT_DATA:
+            individual_result["top_bacteria_plot_data"] = plot_data[row]["top_bacteria"]
+            individual_result["pcoa_plot_data"] = plot_data[row]["pcoa"]
+        else:
+            if row % block_size == 0 and row + block_size < len(batch_positions): submit_plot_block(row + block_size)
+            with timer.stage("plots_wait"):
+                plot_result = plot_futures[row].result()
+            plot_futures[row] = None
+            for plot_name, seconds in plot_result.pop("render_seconds").items():
+                timer.add(f"plot_{plot_name}", seconds)
+            individual_result.update(plot_result)
+        with timer.stage("insights_wait"):
+            individual_result["gemini_insight_text"] = insight_futures[row].result()
+        yield RECORD_SAMPLE, individual_result
+
+    progress(STAGE_SAVING, 0.95)
@@ -0,0 +1,234 @@
+"""
+Benchmark das etapas do pipeline de análise com dados sintéticos e APIs externas substituídas por stubs locais.
+
+Uso (a partir da raiz do projeto):
+    python -m benchmarks.run_benchmarks --samples 1268 --species 704 --sparsity 0.96 --targets 12
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/antes.json benchmarks/results/depois.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path: sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+import sklearn
+from werkzeug.datastructures import FileStorage
+
+import analysis
+import gerador_html
+from abundance import MATRIX_FORMATS, AbundanceMatrix
+from alpha_diversity import calculate_alpha_diversity
+from beta_diversity import ReferenceOrdination
+from benchmarks.synthetic_data import (DEFAULT_REFERENCE_SAMPLES, DEFAULT_SPARSITY, DEFAULT_SPECIES, generate_abundance_table,
+                                       write_reference_csv, write_targets_csv)
+from insights import InsightPipeline
+from model_registry import compute_reference_fingerprint
+from neighbors import ReferenceNeighbors
+from plots import PLOT_FORMATS, PlotRenderer, top_bacteria_plot_data
+from training import train_models
+
+DEFAULT_RESULTS_FOLDER = os.path.join(ROOT, 'benchmarks', 'results')
+
+
+#Clientes locais com a mesma interface de GeminiClient e EntrezClient (insights.py); `latency` simula o tempo de rede
+class StubLLMClient:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def generate(self, prompt):
+        if self.latency: time.sleep(self.latency)
+        return "Insight sintético gerado localmente para benchmark."
+
+
+class StubPubMedClient:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def esearch(self, query, max_articles):
+        if self.latency: time.sleep(self.latency)
+        return {"IdList": [str(index) for index in range(max_articles)]}
+
+    def efetch(self, id_list):
+        if self.latency: time.sleep(self.latency)
+        return {"PubmedArticle": [{"MedlineCitation": {"Article": {"ArticleTitle": f"Artigo {pmid}",
+                                                                   "Abstract": {"AbstractText": ["Resumo sintético."]}}}}
+                                  for pmid in id_list]}
+
+
+class StageTimer:
+    """Executa cada etapa `repeats` vezes e guarda as durações (segundos) de cada execução."""
+
+    def __init__(self, repeats):
+        self.repeats = repeats
+        self.stages = {}
+
+    def run(self, name, fn, repeats=None):
+        durations, result = [], None
+        for _ in range(repeats or self.repeats):
+            start = time.perf_counter()
+            result = fn()
+            durations.append(time.perf_counter() - start)
+        self.stages[name] = {"runs": durations, "min": min(durations), "median": statistics.median(durations),
+                             "mean": statistics.fmean(durations)}
+        print(f"  {name:<24} mediana {self.stages[name]['median']:.4f}s ({len(durations)}x)")
+        return result
+
+
+def _upload(content, filename):
+    return FileStorage(stream=io.BytesIO(content), filename=filename)
+
+
+def run_benchmarks(args):
+    work_dir = tempfile.mkdtemp(prefix="microbiota_bench_")
+    try:
+        return _run_stages(args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _run_stages(args, work_dir):
+    analysis.init_analysis_services({
+        'UPLOAD_FOLDER': os.path.join(work_dir, 'uploads'),
+        'MODEL_CACHE_FOLDER': os.path.join(work_dir, 'model_cache'),
+        'INSIGHT_CACHE_PATH': os.path.join(work_dir, 'insights.sqlite3'),
+        'ABUNDANCE_MATRIX_FORMAT': args.matrix_format,
+        'PLOT_FORMAT': args.plot_format,
+        'PLOT_MAX_WORKERS': args.plot_workers,
+    })
+    #Insights sem rede e sem cache, para medir sempre o custo da etapa
+    analysis.insight_pipeline = InsightPipeline(llm_client=StubLLMClient(args.stub_latency), pubmed_client=StubPubMedClient(args.stub_latency),
+                                                rate_limiter=None, cache=None)
+
+    print(f"Gerando dados sintéticos: referência {args.samples}x{args.species}, {args.targets} alvos, esparsidade {args.sparsity}")
+    reference_df = generate_abundance_table(args.samples, args.species, args.sparsity, seed=args.seed)
+    targets_df = generate_abundance_table(args.targets, args.species, args.sparsity, seed=args.seed + 1)
+    reference_path = os.path.join(work_dir, 'referencia.csv')
+    targets_path = os.path.join(work_dir, 'alvos.csv')
+    write_reference_csv(reference_df, reference_path)
+    write_targets_csv(targets_df, targets_path)
+    with open(reference_path, 'rb') as f: reference_bytes = f.read()
+    with open(targets_path, 'rb') as f: targets_bytes = f.read()
+    del reference_df, targets_df
+
+    timer = StageTimer(args.repeats)
+    print("Etapas:")
+    reference_db, error = timer.run("load_reference", lambda: analysis.load_data_from_memory(
+        _upload(reference_bytes, 'referencia.csv'), required_columns=analysis.TARGET_VARIABLES))
+    if error: raise RuntimeError(error)
+    targets, error = timer.run("load_targets", lambda: analysis.load_data_from_memory(_upload(targets_bytes, 'alvos.csv')))
+    if error: raise RuntimeError(error)
+    species_columns = analysis.reference_species_columns(reference_db)
+
+    reference_matrix = timer.run("abundance_matrix", lambda: AbundanceMatrix.from_frame(reference_db, species_columns, args.matrix_format))
+    target_matrix = AbundanceMatrix.from_frame(targets, species_columns, args.matrix_format)
+    #Apenas o treinamento (avaliação + modelos finais), com as mesmas opções da análise
+    timer.run("training", lambda: train_models(reference_matrix.values, reference_db[analysis.TARGET_VARIABLES].to_numpy(dtype=float),
+                                               analysis.TARGET_VARIABLES, n_jobs=analysis.settings['TRAINING_N_JOBS'],
+                                               cv_folds=analysis.settings['TRAINING_CV_FOLDS']), repeats=args.training_repeats)
+    #O pacote completo inclui os modelos, a diversidade alfa, a PCoA e o índice de vizinhos da referência (também medidos separadamente)
+    bundle = timer.run("reference_bundle", lambda: analysis.train_reference_bundle(reference_db, species_columns), repeats=args.training_repeats)
+    timer.run("alpha_reference", lambda: calculate_alpha_diversity(reference_matrix.values))
+    ordination = timer.run("pcoa_reference", lambda: ReferenceOrdination(reference_matrix), repeats=args.training_repeats)
+
+    predictions = timer.run("prediction", lambda: bundle["models"].predict(target_matrix.values))
+    timer.run("alpha_targets", lambda: calculate_alpha_diversity(target_matrix.values))
+    target_coords = timer.run("pcoa_projection", lambda: ordination.project(target_matrix)[:, :2])
+    top_bacteria = timer.run("top_n", lambda: target_matrix.top_n(10))
+    neighbors = timer.run("neighbors_reference", lambda: ReferenceNeighbors(reference_matrix, reference_db['age_months'], reference_db['body_weight']),
+                          repeats=args.training_repeats)
+    timer.run("similar_samples", lambda: neighbors.query(target_matrix, k=5))
+
+    if args.plot_format != 'data':
+        renderer = PlotRenderer(max_workers=args.plot_workers)
+        tasks = [{"sample_name": f"amostra {row}", "plot_format": args.plot_format,
+                  "top_bacteria": top_bacteria_plot_data(top_bacteria[row]),
+                  "reference_key": "benchmark", "reference_coords": ordination.coordinates[:, :2],
+                  "ages_ref": reference_db['age_months'].values, "target_coords": target_coords[row],
+                  "age_predicted": predictions['age_months'][row]} for row in range(len(target_matrix))]
+        timer.run("plotting", lambda: [future.result() for future in renderer.submit(tasks)])
+        renderer.shutdown()
+    timer.run("insights", lambda: analysis.insight_pipeline.generate_insights(
+        [(f"amostra {row}", list(top_bacteria[row].index[:3])) for row in range(len(target_matrix))]))
+
+    #Pipeline completo com o pacote da referência já no registro (caso comum: mesma referência reenviada)
+    fingerprint = compute_reference_fingerprint(io.BytesIO(reference_bytes), species_columns, analysis.training_options())
+    analysis.model_registry.get_or_train(fingerprint, lambda: bundle)
+    final_results = timer.run("run_analysis_warm", lambda: analysis.run_analysis(
+        _upload(reference_bytes, 'referencia.csv'), [_upload(targets_bytes, 'alvos.csv')]))
+    json_path = timer.run("json_save", lambda: analysis.save_results_to_json(final_results))
+    html_path = os.path.join(work_dir, 'laudo_visual.html')
+    cwd = os.getcwd()
+    os.chdir(ROOT)  #o gerador procura os templates em templates/
+    try:
+        timer.run("html_render", lambda: gerador_html.gerar_html(json_path, output_filename=html_path))
+    finally:
+        os.chdir(cwd)
+
+    return {
+        "created_at": datetime.now().isoformat(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+                        "numpy": np.__version__, "pandas": pd.__version__, "scikit-learn": sklearn.__version__},
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+        "data": {"reference_shape": list(reference_matrix.shape), "target_samples": len(target_matrix),
+                 "reference_csv_bytes": len(reference_bytes), "json_bytes": os.path.getsize(json_path),
+                 "html_bytes": os.path.getsize(html_path)},
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": timer.stages,
+    }
+
+
+#Compara as medianas de cada etapa entre dois relatórios (razão > 1 significa que o segundo ficou mais lento)
+def compare_reports(baseline_path, candidate_path):
+    with open(baseline_path, encoding='utf-8') as f: baseline = json.load(f)
+    with open(candidate_path, encoding='utf-8') as f: candidate = json.load(f)
+    print(f"{'etapa':<24} {'base (s)':>10} {'novo (s)':>10} {'razão':>8}")
+    for stage in dict.fromkeys(list(baseline["stages"]) + list(candidate["stages"])):
+        before = baseline["stages"].get(stage, {}).get("median")
+        after = candidate["stages"].get(stage, {}).get("median")
+        ratio = f"{after / before:.2f}" if before and after is not None else "-"
+        print(f"{stage:<24} {before if before is not None else float('nan'):>10.4f} {after if after is not None else float('nan'):>10.4f} {ratio:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark das etapas da análise de microbiota com dados sintéticos.")
+    parser.add_argument("--samples", type=int, default=DEFAULT_REFERENCE_SAMPLES, help="Amostras da referência sintética.")
+    parser.add_argument("--species", type=int, default=DEFAULT_SPECIES, help="Número de espécies (colunas).")
+    parser.add_argument("--sparsity", type=float, default=DEFAULT_SPARSITY, help="Fração de zeros por amostra.")
+    parser.add_argument("--targets", type=int, default=3, help="Amostras alvo (em um único arquivo com várias linhas).")
+    parser.add_argument("--repeats", type=int, default=3, help="Repetições de cada etapa rápida.")
+    parser.add_argument("--training-repeats", type=int, default=1, help="Repetições do treinamento e da PCoA da referência.")
+    parser.add_argument("--matrix-format", choices=MATRIX_FORMATS, default=analysis.DEFAULT_SETTINGS['ABUNDANCE_MATRIX_FORMAT'])
+    parser.add_argument("--plot-format", choices=PLOT_FORMATS, default=analysis.DEFAULT_SETTINGS['PLOT_FORMAT'])
+    parser.add_argument("--plot-workers", type=int, default=analysis.DEFAULT_SETTINGS['PLOT_MAX_WORKERS'])
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Latência simulada (s) de cada chamada aos stubs de Gemini/PubMed.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("-o", "--output", type=str, default=None, help="Arquivo JSON do relatório (padrão: benchmarks/results/bench_<data>.json).")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NOVO"), help="Compara dois relatórios já gerados.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare)
+        return
+    report = run_benchmarks(args)
+    output = args.output or os.path.join(DEFAULT_RESULTS_FOLDER, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    output_dir = os.path.dirname(output)
+    if output_dir and not os.path.exists(output_dir): os.makedirs(output_dir)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f"Relatório salvo em: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+#Valores padrão com o mesmo formato da base de exemplo (arquivos_referencia_e_alvo/referencia.csv)
+DEFAULT_REFERENCE_SAMPLES = 1268
+DEFAULT_SPECIES = 704
+DEFAULT_SPARSITY = 0.96
+MAX_AGE_MONTHS = 36.0
+
+
+def species_names(n_species):
+    return [f"s__Synthetic_species_{index:05d}" for index in range(n_species)]
+
+
+def generate_abundance_table(n_samples, n_species=DEFAULT_SPECIES, sparsity=DEFAULT_SPARSITY, seed=0):
+    """
+    Gera uma tabela sintética de abundâncias relativas (linhas somando 100) com `age_months` e `body_weight`.
+    Cada espécie tem uma idade preferencial, de modo que a composição da amostra depende da idade (como na referência real)
+    e os modelos têm sinal para aprender. `sparsity` é a fração de zeros por amostra.
+    """
+    if not 0 <= sparsity < 1: raise ValueError("sparsity deve estar no intervalo [0, 1).")
+    rng = np.random.default_rng(seed)
+    ages = rng.uniform(0.5, MAX_AGE_MONTHS, n_samples)
+    body_weights = 3.5 + 0.35 * ages + rng.normal(0, 1.0, n_samples)
+
+    preferred_ages = rng.uniform(0, MAX_AGE_MONTHS, n_species)
+    widths = rng.uniform(3, 12, n_species)
+    base_abundance = rng.lognormal(0, 1.5, n_species)
+    n_present = max(1, int(round((1 - sparsity) * n_species)))
+
+    abundances = np.zeros((n_samples, n_species), dtype=np.float32)
+    for start in range(0, n_samples, 1024):
+        block_ages = ages[start:start + 1024, None]
+        log_weights = np.log(base_abundance) - (block_ages - preferred_ages) ** 2 / (2 * widths ** 2)
+        #Sorteio sem reposição proporcional aos pesos (truque de Gumbel): as `n_present` maiores chaves ficam na amostra
+        keys = log_weights + rng.gumbel(size=log_weights.shape)
+        present = np.argpartition(-keys, n_present - 1, axis=1)[:, :n_present]
+        values = np.exp(np.take_along_axis(log_weights, present, axis=1)) * rng.lognormal(0, 1.0, present.shape)
+        values *= 100.0 / values.sum(axis=1, keepdims=True)
+        np.put_along_axis(abundances[start:start + 1024], present, values.astype(np.float32), axis=1)
+
+    df = pd.DataFrame(abundances, columns=species_names(n_species))
+    df["age_months"] = np.round(ages, 2)
+    df["body_weight"] = np.round(body_weights, 2)
+    return df
+
+
+def write_reference_csv(df, path):
+    """Grava a referência como a base de exemplo: separador ';' e sem coluna de índice."""
+    df.to_csv(path, sep=';', index=False)
+
+
+def write_targets_csv(df, path):
+    """Grava as amostras alvo como o alvo_1.csv: separador ',' e coluna de índice sem nome (identificador da amostra)."""
+    df.to_csv(path, sep=',', index=True)
@@ -0,0 +1,53 @@
+import numpy as np
+from scipy.linalg import eigh
+
+from abundance import AbundanceMatrix, bray_curtis_distances
+
+
+class ReferenceOrdination:
+    """
+    PCoA (Bray-Curtis) da base de referência calculada uma única vez.
+    Guarda autovetores, autovalores e os termos de centralização de Gower, permitindo posicionar novas amostras
+    no mesmo espaço PC1/PC2 usando apenas as distâncias delas até as amostras de referência.
+    Aceita uma AbundanceMatrix (esparsa ou densa) ou um array; a matriz da referência é mantida no formato recebido.
+    """
+
+    def __init__(self, reference_matrix, n_components=2):
+        self.reference_matrix = reference_matrix if isinstance(reference_matrix, AbundanceMatrix) else np.asarray(reference_matrix, dtype=float)
+        n_samples = self.reference_matrix.shape[0]
+        if n_samples < 3:
+            raise ValueError("PCoA requer ao menos 3 amostras de referência.")
+
+        distances = bray_curtis_distances(self.reference_matrix)
+        if np.isnan(distances).any(): raise ValueError("Distâncias Bray-Curtis com valores NaN na referência.")
+        centered = -0.5 * distances ** 2
+        #Termos de centralização (duplo centramento de Gower), reutilizados na projeção de novas amostras
+        self.row_means = centered.mean(axis=1)
+        self.grand_mean = self.row_means.mean()
+        centered -= self.row_means[:, None]
+        centered -= self.row_means[None, :]
+        centered += self.grand_mean
+
+        n_components = min(n_components, n_samples - 1)
+        eigvals, eigvecs = eigh(centered, subset_by_index=[n_samples - n_components, n_samples - 1])
+        order = np.argsort(eigvals)[::-1]
+        eigvals, eigvecs = eigvals[order], eigvecs[:, order]
+        if (eigvals <= 0).any(): raise ValueError("PCoA da referência sem autovalores positivos suficientes.")
+        #Sinal determinístico dos eixos (maior componente em módulo sempre positivo)
+        signs = np.sign(eigvecs[np.abs(eigvecs).argmax(axis=0), np.arange(eigvecs.shape[1])])
+        eigvecs *= signs
+
+        self.eigenvalues = eigvals
+        self.eigenvectors = eigvecs
+        self.coordinates = eigvecs * np.sqrt(eigvals)
+
+    def project(self, samples_matrix):
+        """Projeta novas amostras (linhas) nos eixos fixos da referência. Retorna uma matriz (n_amostras x n_componentes)."""
+        if not isinstance(samples_matrix, AbundanceMatrix): samples_matrix = np.atleast_2d(np.asarray(samples_matrix, dtype=float))
+        centered = -0.5 * bray_curtis_distances(samples_matrix, self.reference_matrix) ** 2
+        centered -= centered.mean(axis=1, keepdims=True)
+        centered -= self.row_means[None, :]
+        centered += self.grand_mean
+        coords = centered @ self.eigenvectors / np.sqrt(self.eigenvalues)
+        if np.isnan(coords).any(): raise ValueError("Coordenadas PCoA com valores NaN.")
+        return coords
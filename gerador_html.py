@@ -1,33 +1,187 @@
 import json
 import argparse
+import base64
+import functools
+import glob
+import hashlib
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
 from jinja2 import Environment, FileSystemLoader
 import os
 
+from result_stream import FIGURE_FIELDS, RECORD_ANALYSIS, RECORD_SAMPLE, iter_ndjson_records, load_ndjson_results
+
+TEMPLATES_DIR = 'templates/'
+DEFAULT_BATCH_OUTPUT_DIR = 'laudos'
+DEFAULT_FIGURES_DIR = os.path.join('uploads', 'figures')
+#Arquivos de resultados procurados quando a entrada do modo em lote é um diretório
+BATCH_INPUT_PATTERNS = ("analysis_results_*.json", "analysis_results_*.ndjson")
+
+#Critérios para considerar os laudos de uma entrada atualizados: data de modificação ou conteúdo (SHA-256)
+CHECK_MTIME = "mtime"
+CHECK_HASH = "hash"
+CHECK_MODES = (CHECK_MTIME, CHECK_HASH)
+#Registro, na pasta de saída de cada entrada, do estado da entrada/template e dos laudos gerados
+STAMP_FILENAME = ".laudos.json"
+#Tamanho mínimo de cada leitura do arquivo na leitura incremental de documentos JSON
+JSON_READ_CHUNK_SIZE = 1024 * 1024
+
+
+#Ambiente do Jinja2 e template compilados uma única vez por processo (e não a cada laudo)
+@functools.lru_cache(maxsize=None)
+def _get_template(template_name, templates_dir=TEMPLATES_DIR):
+    env = Environment(loader=FileSystemLoader(templates_dir), auto_reload=False)
+    return env.get_template(template_name)
+
+
+def _figure_fields_by_name():
+    return {figure_name: field for field, figure_name in FIGURE_FIELDS.items()}
+
+
+#Registros da API com figuras referenciadas por id recebem as imagens de volta em base64, se ainda estiverem em disco
+def _inline_figures(sample, analysis_id, figures_dir):
+    figures = sample.pop("figures", None)
+    if not figures or not analysis_id: return sample
+    fields = _figure_fields_by_name()
+    for figure_name, figure_id in figures.items():
+        path = os.path.join(figures_dir, analysis_id, figure_id)
+        if figure_name in fields and os.path.isfile(path):
+            with open(path, 'rb') as f:
+                sample[fields[figure_name]] = base64.b64encode(f.read()).decode('utf-8')
+    return sample
+
+
+class _JsonReader:
+    """
+    Leitura incremental de um documento JSON: cada valor é decodificado com json.JSONDecoder.raw_decode sobre um buffer que
+    recebe mais texto do arquivo apenas quando o valor ainda não está completo.
+    """
+
+    def __init__(self, file, chunk_size=JSON_READ_CHUNK_SIZE):
+        self._file = file
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    #Descarta o texto já consumido e lê ao menos o tamanho do que resta, para que valores grandes não sejam redecodificados muitas vezes
+    def _fill(self):
+        chunk = self._file.read(max(self._chunk_size, len(self._buffer) - self._pos))
+        if not chunk:
+            self._eof = True
+            return
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+
+    def peek(self):
+        """Próximo caractere que não é espaço em branco, sem consumi-lo ('' no fim do arquivo)."""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in " \t\r\n":
+                self._pos += 1
+            if self._pos < len(self._buffer) or self._eof: return self._buffer[self._pos:self._pos + 1]
+            self._fill()
+
+    def expect(self, char):
+        if self.peek() != char: raise ValueError(f"JSON inválido: esperado '{char}'")
+        self._pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                #Um número no fim do buffer pode estar incompleto: só é aceito se houver texto depois dele
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof: raise
+            self._fill()
+
+
+def _iter_json_object(filepath, array_key):
+    """
+    Percorre o objeto de nível superior de um arquivo JSON produzindo (chave, valor, é_item). Os elementos da lista `array_key`
+    são produzidos um a um (é_item verdadeiro), sem carregar a lista inteira em memória.
+    """
+    with open(filepath, 'r', encoding='utf-8') as f:
+        reader = _JsonReader(f)
+        reader.expect("{")
+        if reader.peek() == "}": return
+        while True:
+            key = reader.value()
+            reader.expect(":")
+            if key == array_key and reader.peek() == "[":
+                reader.expect("[")
+                while reader.peek() != "]":
+                    yield key, reader.value(), True
+                    if reader.peek() == ",": reader.expect(",")
+                reader.expect("]")
+            else:
+                yield key, reader.value(), False
+            if reader.peek() != ",": break
+            reader.expect(",")
+        reader.expect("}")
+
+
+def iter_results(filepath, figures_dir=DEFAULT_FIGURES_DIR):
+    """
+    Lê um arquivo de resultados e produz (cabeçalho, amostra) para cada amostra, mantendo em memória uma amostra por vez.
+    Arquivos .ndjson (API em streaming) são lidos linha a linha. Arquivos .json são lidos de forma incremental em duas passadas:
+    a primeira monta o cabeçalho (campos como reference_pcoa e timings podem vir depois das amostras), a segunda produz as amostras.
+    """
+    if filepath.endswith(".ndjson"):
+        header = None
+        for record_type, record in iter_ndjson_records(filepath):
+            if record_type == RECORD_ANALYSIS:
+                header = record
+            elif record_type == RECORD_SAMPLE and header is not None:
+                record.pop("index", None)
+                yield header, _inline_figures(record, header.get("analysis_id"), figures_dir)
+        if header is None: raise ValueError(f"O arquivo '{filepath}' não contém o registro inicial da análise.")
+        return
+    header = {key: value for key, value, is_item in _iter_json_object(filepath, "individual_analyses") if not is_item}
+    header.pop("individual_analyses", None)
+    for _, sample, is_item in _iter_json_object(filepath, "individual_analyses"):
+        if is_item: yield header, sample
+
+
+def load_results(filepath, figures_dir=DEFAULT_FIGURES_DIR):
+    """Documento de resultados completo, no formato esperado pelo template, a partir de um arquivo JSON ou NDJSON."""
+    if filepath.endswith(".ndjson"):
+        results_data = load_ndjson_results(filepath)
+        for sample in results_data["individual_analyses"]:
+            _inline_figures(sample, results_data.get("analysis_id"), figures_dir)
+        return results_data
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
 def gerar_html(json_filepath, template_name='results.html', output_filename='laudo_visual.html'):
     """
     Gera um arquivo HTML a partir de um JSON de resultados e um template Jinja2.
     """
     print(f"Lendo o arquivo de resultados: {json_filepath}")
-    
-    # Carrega os dados do arquivo JSON
+
+    # Carrega os dados do arquivo JSON (ou NDJSON, gerado pela API)
     try:
-        with open(json_filepath, 'r', encoding='utf-8') as f:
-            results_data = json.load(f)
+        results_data = load_results(json_filepath)
     except FileNotFoundError:
         print(f"Erro: Arquivo de entrada não encontrado em '{json_filepath}'")
         return
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, ValueError):
         print(f"Erro: O arquivo '{json_filepath}' não contém um JSON válido.")
         return
 
     print("Carregando o template HTML...")
-    
-    # Configura o ambiente do Jinja2 para encontrar o template na pasta 'templates'
-    env = Environment(loader=FileSystemLoader('templates/'))
-    template = env.get_template(template_name)
+
+    # Template da pasta 'templates', compilado uma única vez por processo
+    template = _get_template(template_name)
 
     print("Renderizando o HTML com os dados do JSON...")
-    
+
     # --- MUDANÇA AQUI ---
     # Renderiza o template, passando os dados e a "bandeira" de modo independente
     html_content = template.render(results=results_data, standalone_mode=True)
@@ -44,15 +198,148 @@ def gerar_html(json_filepath, template_name='results.html', output_filename='lau
         print(f"Erro ao salvar o arquivo HTML: {e}")
 
 
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+#Estado da entrada e do template usado para decidir se os laudos precisam ser gerados novamente
+def _source_state(filepath, template_path, check):
+    if check == CHECK_HASH:
+        return {"check": check, "source": _file_hash(filepath), "template": _file_hash(template_path)}
+    return {"check": check, "source": os.stat(filepath).st_mtime_ns, "template": os.stat(template_path).st_mtime_ns}
+
+
+def _read_stamp(stamp_path):
+    try:
+        with open(stamp_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _safe_filename(name):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', str(name)).strip('._')[:80] or "amostra"
+
+
+def _batch_output_dir(filepath, output_dir):
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(filepath))[0])
+
+
+def render_sample_reports(filepath, output_dir, template_name='results.html', check=CHECK_MTIME, force=False,
+                          figures_dir=DEFAULT_FIGURES_DIR):
+    """
+    Gera um laudo HTML por amostra de um arquivo de resultados, em `output_dir/<nome do arquivo>/`.
+    A entrada é ignorada quando nem ela nem o template mudaram desde a última geração (por data de modificação ou conteúdo).
+    Retorna (arquivo, situação, número de laudos); a situação é "rendered", "skipped" ou "error: <mensagem>".
+    """
+    try:
+        target_dir = _batch_output_dir(filepath, output_dir)
+        stamp_path = os.path.join(target_dir, STAMP_FILENAME)
+        state = _source_state(filepath, os.path.join(TEMPLATES_DIR, template_name), check)
+        stamp = _read_stamp(stamp_path)
+        if (not force and stamp is not None and stamp.get("state") == state
+                and all(os.path.exists(os.path.join(target_dir, name)) for name in stamp.get("files", []))):
+            return filepath, "skipped", 0
+        if not os.path.exists(target_dir): os.makedirs(target_dir, exist_ok=True)
+        template = _get_template(template_name)
+        files = []
+        for index, (header, sample) in enumerate(iter_results(filepath, figures_dir)):
+            filename = f"{index:04d}_{_safe_filename(sample.get('filename'))}.html"
+            html_content = template.render(results=dict(header, individual_analyses=[sample]), standalone_mode=True)
+            with open(os.path.join(target_dir, filename), 'w', encoding='utf-8') as f:
+                f.write(html_content)
+            files.append(filename)
+        #Laudos de uma geração anterior que não existem mais (ex.: amostras removidas) são apagados
+        for name in (stamp or {}).get("files", []):
+            if name not in files and os.path.exists(os.path.join(target_dir, name)): os.remove(os.path.join(target_dir, name))
+        with open(stamp_path, 'w', encoding='utf-8') as f:
+            json.dump({"state": state, "files": files}, f)
+        return filepath, "rendered", len(files)
+    except Exception as e:
+        return filepath, f"error: {e}", 0
+
+
+def _expand_inputs(inputs):
+    paths = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for pattern in BATCH_INPUT_PATTERNS:
+                paths.extend(glob.glob(os.path.join(entry, pattern)))
+        else:
+            paths.extend(glob.glob(entry) if glob.has_magic(entry) else [entry])
+    return sorted(dict.fromkeys(paths))
+
+
+#Inicialização de cada processo do pool: o template é compilado uma única vez por processo
+def _init_batch_worker(template_name):
+    _get_template(template_name)
+
+
+def _render_batch_item(args):
+    return render_sample_reports(*args)
+
+
+def gerar_html_lote(inputs, output_dir=DEFAULT_BATCH_OUTPUT_DIR, template_name='results.html', workers=None, check=CHECK_MTIME,
+                    force=False, figures_dir=DEFAULT_FIGURES_DIR):
+    """
+    Modo em lote: gera um laudo por amostra para cada arquivo de resultados (diretórios, padrões glob ou caminhos),
+    distribuindo os arquivos entre `workers` processos. Retorna a contagem de arquivos por situação.
+    """
+    if check not in CHECK_MODES: raise ValueError(f"Critério de atualização desconhecido: {check}")
+    paths = _expand_inputs(inputs)
+    workers = workers or os.cpu_count() or 1
+    print(f"Modo em lote: {len(paths)} arquivo(s) de resultados, {min(workers, max(len(paths), 1))} processo(s), saída em '{output_dir}'")
+    tasks = [(path, output_dir, template_name, check, force, figures_dir) for path in paths]
+    if workers <= 1 or len(tasks) <= 1:
+        outcomes = map(_render_batch_item, tasks)
+        executor = None
+    else:
+        #'spawn' pelos mesmos motivos dos demais pools do projeto; os arquivos são enviados em blocos para reduzir a comunicação
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_batch_worker, initargs=(template_name,))
+        outcomes = executor.map(_render_batch_item, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+    counts = {"rendered": 0, "skipped": 0, "error": 0, "reports": 0}
+    try:
+        for filepath, status, n_reports in outcomes:
+            if status.startswith("error"):
+                counts["error"] += 1
+                print(f"Erro ao gerar os laudos de '{filepath}': {status[len('error: '):]}")
+                continue
+            counts[status] += 1
+            counts["reports"] += n_reports
+    finally:
+        if executor is not None: executor.shutdown()
+    print(f"Concluído: {counts['rendered']} arquivo(s) processado(s) ({counts['reports']} laudo(s)), "
+          f"{counts['skipped']} já atualizado(s), {counts['error']} com erro.")
+    return counts
+
+
 def main():
     """Função principal para rodar o script."""
     parser = argparse.ArgumentParser(description="Gerador de Laudos HTML a partir de arquivos JSON.")
-    parser.add_argument("json_filepath", type=str, help="Caminho para o arquivo JSON de resultados.")
+    parser.add_argument("json_filepath", type=str, nargs="+",
+                        help="Caminho para o arquivo JSON (ou NDJSON) de resultados. No modo em lote: arquivos, diretórios ou padrões glob.")
     parser.add_argument("-o", "--output", type=str, default="laudo_visual.html", help="Nome do arquivo HTML de saída (padrão: laudo_visual.html).")
-    
+    parser.add_argument("--batch", action="store_true",
+                        help="Modo em lote (automático com vários arquivos, diretórios ou padrões glob): um laudo por amostra.")
+    parser.add_argument("--output-dir", type=str, default=DEFAULT_BATCH_OUTPUT_DIR, help="Pasta de saída do modo em lote (padrão: laudos).")
+    parser.add_argument("--workers", type=int, default=None, help="Processos do modo em lote (padrão: número de núcleos).")
+    parser.add_argument("--check", choices=CHECK_MODES, default=CHECK_MTIME,
+                        help="Critério para ignorar entradas já atualizadas: data de modificação (mtime) ou conteúdo (hash).")
+    parser.add_argument("--force", action="store_true", help="Gera novamente todos os laudos do lote, mesmo os atualizados.")
+    parser.add_argument("--figures-dir", type=str, default=DEFAULT_FIGURES_DIR, help="Pasta das figuras referenciadas por id nos arquivos NDJSON.")
+
     args = parser.parse_args()
-    gerar_html(args.json_filepath, output_filename=args.output)
+    entries = args.json_filepath
+    if args.batch or len(entries) > 1 or os.path.isdir(entries[0]) or glob.has_magic(entries[0]):
+        gerar_html_lote(entries, args.output_dir, workers=args.workers, check=args.check, force=args.force, figures_dir=args.figures_dir)
+    else:
+        gerar_html(entries[0], output_filename=args.output)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
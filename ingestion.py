@@ -0,0 +1,106 @@
+import csv
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
+
+#Delimitadores aceitos nos arquivos CSV (a base de referência usa ';' e os arquivos alvo usam ',')
+CSV_DELIMITERS = [',', ';', '\t', '|']
+
+#Tamanho dos blocos lidos até encontrar o fim do cabeçalho (arquivos largos têm cabeçalhos com dezenas de KB)
+_HEADER_CHUNK_SIZE = 64 * 1024
+_MAX_HEADER_SIZE = 16 * 1024 * 1024
+
+
+class IngestionError(ValueError):
+    """Arquivo que não pode ser lido ou que não contém as colunas necessárias."""
+
+
+#Lê apenas a primeira linha do arquivo e devolve o ponteiro ao início
+def _read_header_line(stream):
+    stream.seek(0)
+    header = b""
+    while b"\n" not in header and len(header) < _MAX_HEADER_SIZE:
+        chunk = stream.read(_HEADER_CHUNK_SIZE)
+        if not chunk: break
+        header += chunk
+    stream.seek(0)
+    return header.split(b"\n", 1)[0].decode('utf-8-sig', errors='replace').rstrip("\r")
+
+
+#O delimitador é o candidato mais frequente no cabeçalho (fora de aspas), sem precisar analisar o arquivo inteiro
+def sniff_delimiter(header_line):
+    counts = {}
+    for delimiter in CSV_DELIMITERS:
+        counts[delimiter] = len(next(csv.reader([header_line], delimiter=delimiter), [])) - 1
+    delimiter = max(CSV_DELIMITERS, key=lambda candidate: counts[candidate])
+    if counts[delimiter] <= 0: raise IngestionError("Não foi possível identificar o delimitador do arquivo CSV.")
+    return delimiter
+
+
+def _check_required_columns(columns, required_columns):
+    for column in required_columns:
+        if column not in columns: raise IngestionError(f"Coluna necessária '{column}' não encontrada.")
+
+
+#Colunas sem nome recebem o mesmo nome gerado pelo parser C do pandas ('Unnamed: <posição>'), usado para identificar as amostras
+def _fill_unnamed(columns):
+    return [column if column else f"Unnamed: {position}" for position, column in enumerate(columns)]
+
+
+def _species_dtypes(columns, metadata_columns, species_dtype):
+    return {column: species_dtype for column in columns if column.strip() and column.strip() not in metadata_columns}
+
+
+def _read_csv(stream, required_columns, metadata_columns, species_dtype):
+    header_line = _read_header_line(stream)
+    if not header_line.strip(): raise IngestionError("Arquivo vazio ou formato não suportado/lido.")
+    delimiter = sniff_delimiter(header_line)
+    columns = next(csv.reader([header_line], delimiter=delimiter))
+    #As colunas obrigatórias são verificadas pelo cabeçalho, antes da leitura completa
+    _check_required_columns([column.strip() for column in columns], required_columns)
+    try:
+        df = pd.read_csv(stream, sep=delimiter, engine=CSV_ENGINE, dtype=_species_dtypes(columns, metadata_columns, species_dtype))
+    except ValueError:
+        #Alguma coluna de espécie não é numérica: o arquivo é relido sem tipos declarados e convertido em seguida
+        stream.seek(0)
+        df = pd.read_csv(stream, sep=delimiter, engine=CSV_ENGINE)
+    df.columns = _fill_unnamed([str(column).strip() for column in df.columns])
+    return df
+
+
+def read_table(file_storage, required_columns=(), metadata_columns=(), species_dtype=np.float32):
+    """
+    Lê um arquivo de abundâncias (CSV ou Excel) enviado pelo usuário.
+    No CSV o delimitador é detectado pelo cabeçalho e o arquivo é lido pelo parser C (ou pyarrow, se instalado), com as
+    colunas de espécie (todas exceto `metadata_columns`) já em `species_dtype`. Retorna (DataFrame, None) ou (None, mensagem de erro).
+    """
+    try:
+        filename = file_storage.filename
+        stream = file_storage.stream
+        df = None
+        if filename.endswith('.csv'):
+            df = _read_csv(stream, required_columns, metadata_columns, species_dtype)
+        elif filename.endswith(('.xlsx', '.xls')):
+            stream.seek(0)
+            df = pd.read_excel(stream)
+            stream.seek(0)
+            df.columns = [str(column).strip() for column in df.columns]
+            _check_required_columns(df.columns, required_columns)
+
+        if df is None or df.empty:
+            raise IngestionError("Arquivo vazio ou formato não suportado/lido.")
+        #Garante o tipo compacto também para Excel e para a leitura sem tipos declarados
+        numeric_species = [column for column, dtype in df.dtypes.items()
+                           if column not in metadata_columns and not column.startswith("Unnamed: ")
+                           and pd.api.types.is_numeric_dtype(dtype) and dtype != species_dtype]
+        if numeric_species:
+            df[numeric_species] = df[numeric_species].astype(species_dtype)
+        return df, None
+    except Exception as e:
+        return None, str(e)
@@ -0,0 +1,88 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cachetools import TTLCache
+
+
+#Chave normalizada e independente de ordem para um conjunto de bactérias (ex.: top 3 de uma amostra)
+def bacteria_set_key(bacteria_names):
+    normalized = {name.strip().lower() for name in bacteria_names if name and name.strip()}
+    return "|".join(sorted(normalized))
+
+
+class InsightCache:
+    """
+    Cache dos insights (consulta PubMed, resumos e texto final) indexado pelo conjunto de bactérias dominantes.
+    Mantém uma camada em memória (LRU com TTL) e uma camada em disco (SQLite) que sobrevive a reinicializações.
+    A validade de uma entrada conta sempre a partir da sua gravação original, inclusive quando ela é trazida do disco para a memória;
+    entradas vencidas são removidas do disco na inicialização.
+    """
+
+    def __init__(self, db_path, ttl_seconds=7 * 24 * 3600, max_in_memory=1024):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self._memory = TTLCache(maxsize=max_in_memory, ttl=ttl_seconds)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir): os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS insights (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)")
+        try:
+            self.purge_expired()
+        except Exception as e:
+            print(f"DEBUG: Falha ao remover insights vencidos do cache: {e}")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get(self, bacteria_names):
+        key = bacteria_set_key(bacteria_names)
+        #A memória guarda (momento da gravação, valor), para que entradas vindas do disco não ganhem um TTL novo
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and time.time() - entry[0] < self.ttl_seconds:
+                self.memory_hits += 1
+                return entry[1]
+        value = None
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT value, created_at FROM insights WHERE key = ?", (key,)).fetchone()
+            if row is not None and time.time() - row[1] < self.ttl_seconds:
+                value, created_at = json.loads(row[0]), row[1]
+        except Exception as e:
+            print(f"DEBUG: Falha ao ler o cache de insights: {e}")
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+                self._memory[key] = (created_at, value)
+        return value
+
+    def set(self, bacteria_names, value):
+        key = bacteria_set_key(bacteria_names)
+        created_at = time.time()
+        with self._lock:
+            self._memory[key] = (created_at, value)
+        try:
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO insights (key, value, created_at) VALUES (?, ?, ?)",
+                             (key, json.dumps(value, ensure_ascii=False), created_at))
+        except Exception as e:
+            print(f"DEBUG: Falha ao gravar o cache de insights: {e}")
+
+    def purge_expired(self):
+        """Remove do disco as entradas com TTL vencido."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM insights WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+
+    def stats(self):
+        with self._lock:
+            return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "in_memory": len(self._memory)}
@@ -0,0 +1,299 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from insight_cache import bacteria_set_key
+from metrics import EXTERNAL_CALL_ERRORS, external_call, registry as metrics_registry
+
+#Limites de requisições por segundo do NCBI (E-utilities): 3 sem chave de API e 10 com chave
+NCBI_REQUESTS_PER_SECOND_WITHOUT_KEY = 3
+NCBI_REQUESTS_PER_SECOND_WITH_KEY = 10
+
+INSIGHT_UNAVAILABLE_TEXT = "Insight da IA indisponível."
+INSIGHT_ERROR_PREFIX = "Erro ao gerar insight da IA"
+
+_gemini_api_configured_successfully = False
+_ncbi_api_configured_successfully = False
+_gemini_api_key = None
+_genai_module = None
+_genai_lock = threading.Lock()
+
+
+class RateLimiter:
+    """Limitador simples (thread-safe) que espaça as chamadas para respeitar um máximo de requisições por segundo."""
+
+    def __init__(self, requests_per_second):
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self.set_rate(requests_per_second)
+
+    def set_rate(self, requests_per_second):
+        self.min_interval = 1.0 / requests_per_second if requests_per_second else 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+ncbi_rate_limiter = RateLimiter(NCBI_REQUESTS_PER_SECOND_WITHOUT_KEY)
+
+#Etapas da geração de um insight: (serviço, operação) para as métricas e a descrição usada nos logs.
+#Os rótulos são os mesmos de external_call, para que estouros de tempo correspondam às séries de latência.
+_STEP_QUERY = ("gemini", "query", "consulta PubMed (Gemini)")
+_STEP_ESEARCH = ("pubmed", "esearch", "busca PubMed")
+_STEP_EFETCH = ("pubmed", "efetch", "resumos PubMed")
+_STEP_SUMMARY = ("gemini", "summary", "resumo Gemini")
+
+
+#O SDK do Gemini (importação pesada) só é carregado e configurado na primeira chamada, e não na inicialização do servidor
+def _genai():
+    global _genai_module
+    with _genai_lock:
+        if _genai_module is None:
+            import google.generativeai as genai
+            genai.configure(api_key=_gemini_api_key)
+            _genai_module = genai
+        return _genai_module
+
+
+#Clientes padrão das APIs externas. Podem ser substituídos por clientes locais (stubs) com os mesmos métodos.
+class GeminiClient:
+    def generate(self, prompt):
+        model = _genai().GenerativeModel()
+        return model.generate_content(prompt).text
+
+
+class EntrezClient:
+    def esearch(self, query, max_articles):
+        from Bio import Entrez
+        handle = Entrez.esearch(db="pubmed", term=query, retmax=max_articles, retmode="xml")
+        try:
+            return Entrez.read(handle)
+        finally:
+            handle.close()
+
+    def efetch(self, id_list):
+        from Bio import Entrez
+        handle = Entrez.efetch(db="pubmed", id=id_list, rettype="abstract", retmode="xml")
+        try:
+            return Entrez.read(handle)
+        finally:
+            handle.close()
+
+
+#Configuração das APIs, feita uma vez por processo. A chave do Gemini é aplicada ao SDK na primeira chamada (ver _genai).
+def configure_apis(gemini_api_key, ncbi_api_key, ncbi_email):
+    global _gemini_api_configured_successfully, _ncbi_api_configured_successfully, _gemini_api_key, _genai_module
+    #Chaves de exemplo ("chave", "INSERIR ...") mantêm a API desconfigurada
+    if gemini_api_key and gemini_api_key != "chave" and not gemini_api_key.startswith("INSERIR"):
+        with _genai_lock:
+            _gemini_api_key = gemini_api_key
+            _genai_module = None
+        _gemini_api_configured_successfully = True
+    if ncbi_email and ncbi_api_key and ncbi_api_key != "chave_ncbi" and not ncbi_api_key.startswith("INSERIR"):
+        from Bio import Entrez
+        Entrez.email = ncbi_email
+        Entrez.api_key = ncbi_api_key
+        _ncbi_api_configured_successfully = True
+        ncbi_rate_limiter.set_rate(NCBI_REQUESTS_PER_SECOND_WITH_KEY)
+
+
+#Um cliente informado explicitamente é sempre usado; caso contrário o cliente padrão só existe se a API foi configurada
+def _resolve_llm_client(llm_client):
+    if llm_client is not None: return llm_client
+    return GeminiClient() if _gemini_api_configured_successfully else None
+
+def _resolve_pubmed_client(pubmed_client):
+    if pubmed_client is not None: return pubmed_client
+    return EntrezClient() if _ncbi_api_configured_successfully else None
+
+def _clean_bacteria_names(top_3_bacteria):
+    return [name.replace("s__", "").replace("_", " ") for name in top_3_bacteria]
+
+
+#Consulta no pubmed com base nas 3 espécies mais abundantes (utilizada para propor um laudo cientifico e individualizado)
+#Com `raise_errors`, falhas da API são propagadas (usado pelo InsightPipeline para não guardar resultados degradados no cache)
+def generate_pubmed_query_for_bacteria(top_3_bacteria, llm_client=None, raise_errors=False):
+    llm_client = _resolve_llm_client(llm_client)
+    if not top_3_bacteria or llm_client is None: return ""
+
+    bacteria_names_clean = _clean_bacteria_names(top_3_bacteria)
+
+    bact_queries = []
+    for bact_name in bacteria_names_clean:
+        bact_queries.append(f'("{bact_name}"[MeSH Terms] OR "{bact_name}"[All Fields])')
+
+    main_bact_query = " OR ".join(bact_queries)
+
+    prompt = (
+        f"Com base na seguinte lista de bactérias: {', '.join(bacteria_names_clean)}, "
+        f"gere uma consulta PubMed. A consulta principal para as bactérias, que já foi pré-formatada, é: `({main_bact_query})`. "
+        f"Sua tarefa é combinar esta consulta principal com termos gerais sobre microbiota intestinal humana usando o operador AND. "
+        f"A saída deve ser APENAS a string da consulta final."
+    )
+    try:
+        with external_call("gemini", "query"):
+            return llm_client.generate(prompt).strip().strip('`" ')
+    except Exception as e:
+        if raise_errors: raise
+        print(f"DEBUG: Erro ao gerar consulta PubMed com Gemini: {e}")
+        return ""
+
+#Busca (esearch) e leitura dos resumos (efetch) separadas, para que cada chamada tenha tempo limite e métricas próprias
+def search_pubmed_ids(query, max_articles=5, pubmed_client=None, rate_limiter=ncbi_rate_limiter):
+    pubmed_client = _resolve_pubmed_client(pubmed_client)
+    if not query or pubmed_client is None: return []
+    if rate_limiter is not None: rate_limiter.wait()
+    with external_call("pubmed", "esearch"):
+        record = pubmed_client.esearch(query, max_articles)
+
+    id_list = record.get("IdList", [])
+    print(f"DEBUG: Encontrados {len(id_list)} artigos no PubMed para a consulta.")
+    return id_list
+
+def fetch_pubmed_summaries(id_list, pubmed_client=None, rate_limiter=ncbi_rate_limiter):
+    pubmed_client = _resolve_pubmed_client(pubmed_client)
+    if not id_list or pubmed_client is None: return []
+    if rate_limiter is not None: rate_limiter.wait()
+    with external_call("pubmed", "efetch"):
+        articles = pubmed_client.efetch(id_list)
+
+    summaries = []
+    for article in articles.get("PubmedArticle", []):
+        title = article.get("MedlineCitation", {}).get("Article", {}).get("ArticleTitle", "")
+        abstract_parts = article.get("MedlineCitation", {}).get("Article", {}).get("Abstract", {}).get("AbstractText", [])
+        abstract = " ".join(abstract_parts) if isinstance(abstract_parts, list) else str(abstract_parts)
+        if title and abstract:
+            summaries.append(f"Título: {title}\nResumo: {abstract}\n")
+    return summaries
+
+def search_pubmed_and_get_summaries(query, max_articles=5, pubmed_client=None, rate_limiter=ncbi_rate_limiter, raise_errors=False):
+    try:
+        id_list = search_pubmed_ids(query, max_articles, pubmed_client=pubmed_client, rate_limiter=rate_limiter)
+        return fetch_pubmed_summaries(id_list, pubmed_client=pubmed_client, rate_limiter=rate_limiter)
+    except Exception as e:
+        if raise_errors: raise
+        print(f"DEBUG: Erro na busca PubMed: {e}")
+        return []
+
+def summarize_articles_or_knowledge_with_gemini(article_texts, top_3_bacteria_names, llm_client=None):
+    llm_client = _resolve_llm_client(llm_client)
+    if llm_client is None: return INSIGHT_UNAVAILABLE_TEXT
+
+    clean_names = ', '.join(_clean_bacteria_names(top_3_bacteria_names))
+    prompt_text = ""
+
+    if article_texts:
+        print("DEBUG: Resumindo com base nos artigos encontrados no PubMed.")
+        combined_text = "\n\n---\n\n".join(article_texts)
+        prompt_text = (
+            f"Você é um assistente de análise de microbioma. Com base nos resumos de artigos científicos fornecidos, escreva um insight conciso sobre o que significa ter {clean_names} como as bactérias mais abundantes em uma amostra. "
+            f"Aborde a funcionalidade, a importância para a saúde e o potencial risco (se aplicável).\n\n"
+            f"Resumos dos artigos:\n\n{combined_text}"
+        )
+    elif top_3_bacteria_names:
+        print("DEBUG: Nenhum artigo encontrado. Resumindo com base no conhecimento geral da IA.")
+        prompt_text = (
+            f"Você é um assistente de análise de microbioma. Baseado no conhecimento científico geral, escreva um insight conciso sobre o que significa ter {clean_names} como as bactérias mais abundantes em uma amostra. "
+            f"Aborde a funcionalidade (o que fazem), a importância para a saúde (se são benéficas) e o potencial perigo (se podem ser patógenos oportunistas ou associadas a problemas quando em excesso)."
+        )
+    else:
+        return "Não foi possível gerar insight (sem bactérias para analisar)."
+
+    try:
+        with external_call("gemini", "summary"):
+            return llm_client.generate(prompt_text)
+    except Exception as e:
+        return f"{INSIGHT_ERROR_PREFIX}: {e}"
+
+
+class InsightPipeline:
+    """
+    Etapa concorrente de geração de insights (Gemini + PubMed) para várias amostras.
+    Cada amostra é processada em um pool limitado de threads; cada chamada externa tem tempo limite próprio e,
+    em caso de falha ou estouro do tempo, a etapa segue com um resultado de contingência.
+    As consultas ao NCBI passam pelo limitador de requisições por segundo. Com um `cache` (InsightCache), conjuntos de
+    bactérias já analisados não geram novas chamadas, e amostras do mesmo conjunto em andamento compartilham o resultado.
+    """
+
+    def __init__(self, max_workers=8, call_timeout=60.0, llm_client=None, pubmed_client=None, rate_limiter=ncbi_rate_limiter, cache=None):
+        self.call_timeout = call_timeout
+        self.cache = cache
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self.llm_client = llm_client
+        self.pubmed_client = pubmed_client
+        self.rate_limiter = rate_limiter
+        self._sample_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="insight")
+        #Chamadas que estouram o tempo continuam ocupando uma thread até terminarem, por isso o pool de chamadas é maior
+        self._call_executor = ThreadPoolExecutor(max_workers=max_workers * 2, thread_name_prefix="insight-call")
+
+    #Retorna (resultado, sucesso); em falha ou estouro do tempo limite retorna o valor de contingência
+    def _call(self, step, fallback, fn, *args, **kwargs):
+        service, operation, description = step
+        future = self._call_executor.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=self.call_timeout), True
+        except FutureTimeoutError:
+            print(f"DEBUG: Tempo limite excedido em '{description}' ({self.call_timeout}s).")
+            metrics_registry.inc(EXTERNAL_CALL_ERRORS, service=service, operation=operation, kind="timeout")
+        except Exception as e:
+            #Falhas das APIs já são contadas por external_call; aqui só são registradas no log
+            print(f"DEBUG: Erro em '{description}': {e}")
+        return fallback, False
+
+    def _run(self, sample_name, top_3_bacteria):
+        print(f"\n--- Gerando Insight para {sample_name} ---")
+        query, query_ok = self._call(_STEP_QUERY, "", generate_pubmed_query_for_bacteria, top_3_bacteria, llm_client=self.llm_client,
+                                     raise_errors=True)
+        if query: print(f"DEBUG: Consulta PubMed gerada: {query}")
+        id_list, search_ok = self._call(_STEP_ESEARCH, [], search_pubmed_ids, query,
+                                        pubmed_client=self.pubmed_client, rate_limiter=self.rate_limiter) if query else ([], True)
+        summaries, fetch_ok = self._call(_STEP_EFETCH, [], fetch_pubmed_summaries, id_list,
+                                         pubmed_client=self.pubmed_client, rate_limiter=self.rate_limiter) if id_list else ([], True)
+        insight, insight_ok = self._call(_STEP_SUMMARY, INSIGHT_UNAVAILABLE_TEXT, summarize_articles_or_knowledge_with_gemini,
+                                         summaries, top_3_bacteria, llm_client=self.llm_client)
+        print(f"--- Fim do Insight ({sample_name}) ---")
+        #Somente resultados completos (sem contingência) podem ir para o cache
+        complete = query_ok and search_ok and fetch_ok and insight_ok and insight != INSIGHT_UNAVAILABLE_TEXT and not insight.startswith(INSIGHT_ERROR_PREFIX)
+        return {"query": query, "summaries": summaries, "insight": insight}, complete
+
+    def _run_safely(self, sample_name, top_3_bacteria):
+        try:
+            if self.cache is not None:
+                cached = self.cache.get(top_3_bacteria)
+                if cached is not None:
+                    print(f"DEBUG: Insight de {sample_name} recuperado do cache.")
+                    return cached["insight"]
+            result, complete = self._run(sample_name, top_3_bacteria)
+            if self.cache is not None and complete:
+                self.cache.set(top_3_bacteria, result)
+            return result["insight"]
+        except Exception as e:
+            return f"{INSIGHT_ERROR_PREFIX}: {e}"
+
+    def _release_in_flight(self, key, future):
+        with self._in_flight_lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def submit(self, sample_name, top_3_bacteria):
+        """Agenda o insight de uma amostra e retorna um Future com o texto final (nunca lança exceção)."""
+        key = bacteria_set_key(top_3_bacteria)
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future
+            future = self._sample_executor.submit(self._run_safely, sample_name, top_3_bacteria)
+            self._in_flight[key] = future
+        future.add_done_callback(lambda done: self._release_in_flight(key, done))
+        return future
+
+    def generate_insights(self, samples):
+        """Gera os insights de uma lista de (nome_da_amostra, top_3_bacterias), preservando a ordem."""
+        futures = [self.submit(sample_name, top_3_bacteria) for sample_name, top_3_bacteria in samples]
+        return [future.result() for future in futures]
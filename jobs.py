@@ -0,0 +1,155 @@
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.datastructures import FileStorage
+
+import analysis
+from insights import configure_apis
+from metrics import ANALYSES, record_stage_timings, registry as metrics_registry
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+STAGE_QUEUED = "fila"
+STAGE_DONE = "concluido"
+
+
+class JobStore:
+    """Armazena o estado das análises em segundo plano em um banco SQLite compartilhado entre processos."""
+
+    COLUMNS = ("job_id", "status", "stage", "progress", "error", "result_path", "created_at", "updated_at")
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir): os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT, "
+                         "progress REAL NOT NULL DEFAULT 0, error TEXT, result_path TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def create(self, job_id):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT INTO jobs (job_id, status, stage, progress, created_at, updated_at) VALUES (?, ?, ?, 0, ?, ?)",
+                         (job_id, JOB_QUEUED, STAGE_QUEUED, now, now))
+
+    def update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(zip(self.COLUMNS, row)) if row else None
+
+
+#Inicialização de cada processo de trabalho: serviços do pipeline e APIs configurados uma única vez por processo.
+#Os gráficos são renderizados no próprio processo de trabalho, pois o paralelismo já vem dos vários jobs simultâneos.
+def _init_worker(settings, api_credentials):
+    analysis.init_analysis_services(dict(settings, PLOT_MAX_WORKERS=0))
+    if api_credentials: configure_apis(*api_credentials)
+
+
+#Executado no processo de trabalho. Os arquivos enviados foram gravados em `job_dir` pelo processo do servidor.
+#Retorna o resultado ("ok", "invalid" ou "error") e os tempos das etapas, registrados nas métricas do servidor.
+def _run_job(store_path, job_id, job_dir, reference_entry, target_entries):
+    store = JobStore(store_path)
+    store.update(job_id, status=JOB_RUNNING)
+
+    def progress(stage, fraction):
+        store.update(job_id, stage=stage, progress=round(fraction, 3))
+
+    streams = []
+    try:
+        def open_upload(entry):
+            filename, path = entry
+            stream = open(path, 'rb')
+            streams.append(stream)
+            return FileStorage(stream=stream, filename=filename)
+        final_results = analysis.run_analysis(open_upload(reference_entry), [open_upload(entry) for entry in target_entries], progress)
+        result_path = analysis.save_results_to_json(final_results, suffix=job_id[:8])
+        if result_path is None: raise RuntimeError("Falha ao salvar o resultado da análise.")
+        store.update(job_id, status=JOB_DONE, stage=STAGE_DONE, progress=1.0, result_path=result_path)
+        return "ok", final_results["timings"]
+    except analysis.AnalysisError as e:
+        store.update(job_id, status=JOB_FAILED, error=str(e))
+        return "invalid", None
+    except Exception as e:
+        print(f"ERRO: Falha na análise em segundo plano {job_id}: {e}")
+        store.update(job_id, status=JOB_FAILED, error=f"Erro inesperado durante a análise: {e}")
+        return "error", None
+    finally:
+        for stream in streams: stream.close()
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+
+class JobManager:
+    """
+    Fila local de análises: os arquivos são gravados em disco, o estado fica no SQLite e o processamento pesado
+    roda em um pool de processos, liberando a requisição HTTP imediatamente.
+    """
+
+    def __init__(self, store_path, jobs_dir, max_workers=2, settings=None, api_credentials=None):
+        self.store = JobStore(store_path)
+        self.jobs_dir = jobs_dir
+        self.max_workers = max_workers
+        self.settings = dict(settings or {})
+        #Credenciais repassadas aos processos de trabalho (None mantém as APIs desconfiguradas, como no servidor)
+        self.api_credentials = api_credentials
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    #O pool é criado na primeira submissão, quando a configuração das APIs do servidor já é conhecida
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                #'spawn' evita herdar threads e locks do servidor (pool de insights) nos processos de trabalho
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=_init_worker, initargs=(self.settings, self.api_credentials))
+            return self._executor
+
+    def submit(self, reference_file, target_files):
+        """Grava os arquivos enviados, registra a análise na fila e retorna o identificador do job."""
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(job_dir)
+        reference_path = os.path.join(job_dir, "reference")
+        reference_file.save(reference_path)
+        target_entries = []
+        for index, target_file in enumerate(target_files):
+            target_path = os.path.join(job_dir, f"target_{index}")
+            target_file.save(target_path)
+            target_entries.append((target_file.filename, target_path))
+        self.store.create(job_id)
+        future = self._get_executor().submit(_run_job, self.store.db_path, job_id, job_dir, (reference_file.filename, reference_path), target_entries)
+        future.add_done_callback(lambda done: self._on_done(job_id, done))
+        return job_id
+
+    #Falhas do próprio pool (ex.: processo de trabalho encerrado) não chegam a atualizar o job dentro do worker.
+    #As métricas dos processos de trabalho não são visíveis no /metrics do servidor, por isso o resultado e os tempos voltam aqui.
+    def _on_done(self, job_id, future):
+        error = future.exception()
+        if error is not None:
+            self.store.update(job_id, status=JOB_FAILED, error=f"Processo de análise interrompido: {error}")
+            metrics_registry.inc(ANALYSES, status="error")
+            return
+        status, timings = future.result()
+        metrics_registry.inc(ANALYSES, status=status)
+        record_stage_timings(timings)
+
+    def get(self, job_id):
+        return self.store.get(job_id)
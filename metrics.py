@@ -0,0 +1,185 @@
+import cProfile
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+#Limites (segundos) dos buckets dos histogramas de duração
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+STAGE_DURATION = "microbiota_stage_duration_seconds"
+EXTERNAL_CALL_DURATION = "microbiota_external_call_duration_seconds"
+EXTERNAL_CALL_ERRORS = "microbiota_external_call_errors_total"
+ANALYSES = "microbiota_analyses_total"
+SAMPLES = "microbiota_samples_total"
+MODEL_REGISTRY_LOOKUPS = "microbiota_model_registry_lookups_total"
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels: return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels) + "}"
+
+
+class MetricsRegistry:
+    """
+    Registro de métricas do processo (contadores e histogramas com rótulos), exposto no formato texto do Prometheus.
+    Coletores registrados com `set_collector` são consultados a cada leitura (ex.: estatísticas do cache de insights).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._descriptions = {}
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = {}
+
+    def describe(self, name, metric_type, help_text):
+        self._descriptions[name] = (metric_type, help_text)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(DURATION_BUCKETS), "count": 0, "sum": 0.0}
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound: histogram["buckets"][index] += 1
+            histogram["count"] += 1
+            histogram["sum"] += value
+
+    #`collector()` retorna uma lista de (nome, tipo, ajuda, rótulos, valor)
+    def set_collector(self, key, collector):
+        with self._lock:
+            self._collectors[key] = collector
+
+    def render(self):
+        """Texto no formato de exposição do Prometheus (versão 0.0.4)."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: {"buckets": list(value["buckets"]), "count": value["count"], "sum": value["sum"]}
+                          for key, value in self._histograms.items()}
+            collectors = list(self._collectors.values())
+        samples = {}
+        for (name, labels), value in counters.items():
+            samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {float(value)!r}")
+        for (name, labels), histogram in histograms.items():
+            lines = samples.setdefault(name, [])
+            for bound, count in zip(DURATION_BUCKETS, histogram["buckets"]):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']!r}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+        descriptions = dict(self._descriptions)
+        for collector in collectors:
+            try:
+                for name, metric_type, help_text, labels, value in collector():
+                    descriptions.setdefault(name, (metric_type, help_text))
+                    samples.setdefault(name, []).append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {float(value)!r}")
+            except Exception as e:
+                print(f"DEBUG: Falha ao coletar métricas: {e}")
+        output = []
+        for name in sorted(samples):
+            if name in descriptions:
+                metric_type, help_text = descriptions[name]
+                output.append(f"# HELP {name} {help_text}")
+                output.append(f"# TYPE {name} {metric_type}")
+            output.extend(samples[name])
+        return "\n".join(output) + "\n"
+
+
+registry = MetricsRegistry()
+registry.describe(STAGE_DURATION, "histogram", "Duração de cada etapa da análise.")
+registry.describe(EXTERNAL_CALL_DURATION, "histogram", "Latência das chamadas às APIs externas (Gemini e PubMed).")
+registry.describe(EXTERNAL_CALL_ERRORS, "counter", "Falhas e estouros de tempo limite nas chamadas às APIs externas.")
+registry.describe(ANALYSES, "counter", "Análises concluídas, por resultado.")
+registry.describe(SAMPLES, "counter", "Amostras alvo analisadas.")
+registry.describe(MODEL_REGISTRY_LOOKUPS, "counter", "Consultas ao registro de modelos (reaproveitados ou treinados).")
+
+
+def observe_stage(name, seconds):
+    registry.observe(STAGE_DURATION, seconds, stage=name)
+
+
+class AnalysisTimer:
+    """
+    Tempos das etapas de uma análise. Cada medição vai para o histograma do processo e é somada no resumo
+    por etapa (`as_dict`), que é incorporado ao documento de resultados.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        observe_stage(name, seconds)
+
+    def as_dict(self):
+        return {"stages": {name: round(seconds, 6) for name, seconds in self.stages.items()},
+                "total_seconds": round(time.perf_counter() - self._started, 6)}
+
+
+#Registra no processo atual os tempos de uma análise executada em outro processo (fila de análises)
+def record_stage_timings(timings):
+    for name, seconds in (timings or {}).get("stages", {}).items():
+        observe_stage(name, seconds)
+
+
+@contextmanager
+def external_call(service, operation):
+    """Mede a latência de uma chamada externa e conta as falhas (exceções propagadas pela chamada)."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.inc(EXTERNAL_CALL_ERRORS, service=service, operation=operation, kind="error")
+        raise
+    finally:
+        registry.observe(EXTERNAL_CALL_DURATION, time.perf_counter() - start, service=service, operation=operation)
+
+
+#O Python só admite um profiler ativo por vez; requisições simultâneas seguem sem perfil
+_profile_lock = threading.Lock()
+
+
+@contextmanager
+def profile_to(folder, label="analysis"):
+    """
+    Executa o bloco sob o cProfile e grava o resultado (.prof, legível com pstats/snakeviz) em `folder`.
+    Retorna o caminho do arquivo, ou None se outro perfil já estiver em andamento. Apenas a thread da requisição é
+    perfilada; gráficos em outros processos e insights em outras threads aparecem como tempo de espera.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        yield None
+        return
+    try:
+        if not os.path.exists(folder): os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{label}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.prof")
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield path
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+            print(f"DEBUG: Perfil de execução salvo em {path}")
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import threading
+
+from cachetools import LRUCache
+
+#Versão do formato dos pacotes persistidos. Deve ser incrementada sempre que o conteúdo do pacote mudar,
+#invalidando automaticamente os arquivos antigos em disco.
+REGISTRY_FORMAT_VERSION = 6
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def compute_reference_fingerprint(file_stream, species_columns, training_options=None):
+    """
+    Calcula a impressão digital (SHA-256) de uma base de referência a partir do conteúdo do arquivo, das colunas de espécie
+    e das opções de treinamento que alteram o pacote (ex.: validação cruzada), para que mudar essas opções gere um novo pacote.
+    O ponteiro do arquivo é devolvido ao início ao final do cálculo.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"v{REGISTRY_FORMAT_VERSION}\n".encode('utf-8'))
+    for key, value in sorted((training_options or {}).items()):
+        digest.update(f"{key}={value}\n".encode('utf-8'))
+    digest.update("\n".join(species_columns).encode('utf-8'))
+    file_stream.seek(0)
+    for chunk in iter(lambda: file_stream.read(_HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    file_stream.seek(0)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """
+    Registro de modelos treinados por base de referência.
+    Os pacotes (modelos, métricas e estatísticas da referência) são persistidos em disco e mantidos em memória com limite LRU.
+    """
+
+    def __init__(self, cache_dir, max_in_memory=2):
+        self.cache_dir = cache_dir
+        self._memory = LRUCache(maxsize=max_in_memory)
+        self._memory_lock = threading.Lock()
+        self._training_locks = {}
+
+    def _bundle_path(self, fingerprint):
+        return os.path.join(self.cache_dir, f"reference_{fingerprint}.joblib")
+
+    def _training_lock(self, fingerprint):
+        with self._memory_lock:
+            return self._training_locks.setdefault(fingerprint, threading.Lock())
+
+    def _get_from_memory(self, fingerprint):
+        with self._memory_lock:
+            return self._memory.get(fingerprint)
+
+    def _put_in_memory(self, fingerprint, bundle):
+        with self._memory_lock:
+            self._memory[fingerprint] = bundle
+
+    def _load_from_disk(self, fingerprint):
+        path = self._bundle_path(fingerprint)
+        if not os.path.exists(path):
+            return None
+        try:
+            import joblib
+            bundle = joblib.load(path)
+        except Exception as e:
+            print(f"DEBUG: Falha ao carregar modelos persistidos em {path}, retreinando: {e}")
+            return None
+        if not isinstance(bundle, dict) or bundle.get("format_version") != REGISTRY_FORMAT_VERSION:
+            return None
+        return bundle
+
+    def _save_to_disk(self, fingerprint, bundle):
+        if not os.path.exists(self.cache_dir): os.makedirs(self.cache_dir)
+        path = self._bundle_path(fingerprint)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            import joblib
+            joblib.dump(bundle, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"ERRO: Falha ao persistir os modelos da referência: {e}")
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+
+    def get(self, fingerprint):
+        """Retorna o pacote já treinado (memória ou disco) ou None, sem treinar."""
+        bundle = self._get_from_memory(fingerprint)
+        if bundle is None:
+            bundle = self._load_from_disk(fingerprint)
+            if bundle is not None:
+                self._put_in_memory(fingerprint, bundle)
+        return bundle
+
+    def preload(self, max_bundles=None):
+        """
+        Carrega em memória os pacotes persistidos mais recentes (até `max_bundles`, por padrão o limite da memória),
+        para que a primeira requisição com essas referências não pague a leitura do disco. Retorna quantos foram carregados.
+        """
+        if not os.path.isdir(self.cache_dir): return 0
+        max_bundles = self._memory.maxsize if max_bundles is None else max_bundles
+        paths = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                 if name.startswith("reference_") and name.endswith(".joblib")]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        loaded = 0
+        #Do mais antigo para o mais recente, para que o mais recente fique no topo do LRU
+        for path in reversed(paths[:max_bundles]):
+            fingerprint = os.path.basename(path)[len("reference_"):-len(".joblib")]
+            if self.get(fingerprint) is not None: loaded += 1
+        return loaded
+
+    def get_or_train(self, fingerprint, train_fn):
+        """
+        Retorna o pacote da referência identificada por `fingerprint`, treinando com `train_fn()` apenas quando
+        ele não existir em memória nem em disco.
+        """
+        bundle = self.get(fingerprint)
+        if bundle is not None:
+            return bundle
+        with self._training_lock(fingerprint):
+            #Outra requisição pode ter concluído o treinamento enquanto esperávamos o lock
+            bundle = self.get(fingerprint)
+            if bundle is not None:
+                return bundle
+            print(f"DEBUG: Treinando modelos para a referência {fingerprint[:12]}...")
+            bundle = dict(train_fn())
+            bundle["format_version"] = REGISTRY_FORMAT_VERSION
+            bundle["fingerprint"] = fingerprint
+            self._save_to_disk(fingerprint, bundle)
+            self._put_in_memory(fingerprint, bundle)
+            return bundle
@@ -0,0 +1,61 @@
+import numpy as np
+from scipy import sparse
+from sklearn.neighbors import NearestNeighbors
+
+from abundance import AbundanceMatrix
+
+
+#Converte cada linha em proporções (soma 1). Para linhas com a mesma soma, Bray-Curtis = Manhattan / 2,
+#portanto um índice de vizinhos com métrica Manhattan sobre as proporções ordena exatamente como o Bray-Curtis.
+def _to_proportions(matrix):
+    values = matrix.values if isinstance(matrix, AbundanceMatrix) else np.atleast_2d(np.asarray(matrix, dtype=float))
+    totals = np.asarray(values.sum(axis=1, dtype=float)).ravel()
+    scale = np.divide(1.0, totals, out=np.zeros_like(totals), where=totals > 0)
+    if sparse.issparse(values):
+        proportions = sparse.csr_matrix(values, dtype=float, copy=True)
+        proportions.data *= np.repeat(scale, np.diff(proportions.indptr))
+        #A distância de Manhattan esparsa do scikit-learn exige índices ordenados em cada linha; o indicador do scipy
+        #nem sempre reflete o estado real dos índices, por isso a ordenação é forçada
+        proportions.has_sorted_indices = False
+        proportions.sort_indices()
+        return proportions, totals > 0
+    return values.astype(float) * scale[:, None], totals > 0
+
+
+class ReferenceNeighbors:
+    """
+    Índice de vizinhos mais próximos (Bray-Curtis) da base de referência, construído uma única vez por referência.
+    Para cada amostra alvo retorna as k amostras da referência mais parecidas, com idade e peso reais.
+    Matrizes esparsas são consultadas em lote (força bruta em blocos do scikit-learn); matrizes densas usam a estrutura
+    escolhida pelo scikit-learn para a métrica Manhattan.
+    """
+
+    def __init__(self, reference_matrix, ages, body_weights, sample_ids=None):
+        proportions, valid = _to_proportions(reference_matrix)
+        #Amostras sem abundâncias não têm Bray-Curtis definido e ficam fora do índice
+        self.reference_rows = np.flatnonzero(valid)
+        if len(self.reference_rows) == 0: raise ValueError("Base de referência sem amostras com abundâncias para o índice de vizinhos.")
+        self.ages = np.asarray(ages, dtype=float)
+        self.body_weights = np.asarray(body_weights, dtype=float)
+        self.sample_ids = list(sample_ids) if sample_ids is not None else [f"Linha {row + 1}" for row in range(len(self.ages))]
+        self._index = NearestNeighbors(metric='manhattan').fit(proportions[self.reference_rows])
+
+    def query(self, samples_matrix, k=5):
+        """Retorna, para cada amostra (linha), a lista das k amostras mais próximas da referência (mais parecida primeiro)."""
+        proportions, valid = _to_proportions(samples_matrix)
+        k = min(k, len(self.reference_rows))
+        results = [[] for _ in range(proportions.shape[0])]
+        rows = np.flatnonzero(valid)
+        if len(rows) == 0 or k <= 0: return results
+        distances, indices = self._index.kneighbors(proportions[rows], n_neighbors=k)
+        for row, row_distances, row_indices in zip(rows, distances / 2.0, indices):
+            for distance, index in zip(row_distances, row_indices):
+                reference_row = int(self.reference_rows[index])
+                results[row].append({
+                    "reference_sample": self.sample_ids[reference_row],
+                    "bray_curtis": float(distance),
+                    "similarity": float(1.0 - distance),
+                    "age_months": None if np.isnan(self.ages[reference_row]) else float(self.ages[reference_row]),
+                    "body_weight": None if np.isnan(self.body_weights[reference_row]) else float(self.body_weights[reference_row]),
+                })
+        return results
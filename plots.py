@@ -0,0 +1,264 @@
+import base64
+import functools
+import io
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+from cachetools import LRUCache
+
+#CORES DA IDENTIDADE VISUAL
+PRIMARY_TEXT_COLOR = "#1A2C4B"
+ACCENT_COLOR = "#E91E63"
+ACCENT_LIGHT_COLOR = "#FCE4EC"
+
+#Formatos de saída dos gráficos: PNG (base64), SVG (base64, vetorial e compacto) ou apenas os dados para renderização no navegador
+PLOT_FORMAT_PNG = "png"
+PLOT_FORMAT_SVG = "svg"
+PLOT_FORMAT_DATA = "data"
+PLOT_FORMATS = (PLOT_FORMAT_PNG, PLOT_FORMAT_SVG, PLOT_FORMAT_DATA)
+
+PLOT_DPI = 150
+
+#O matplotlib só é importado na primeira renderização (no modo 'data' nunca é carregado)
+#Colormaps (barras, PCoA) construídos uma única vez por processo
+@functools.lru_cache(maxsize=None)
+def _colormaps():
+    import matplotlib.colors as mcolors
+    return (mcolors.LinearSegmentedColormap.from_list("grad", [ACCENT_LIGHT_COLOR, ACCENT_COLOR]),
+            mcolors.LinearSegmentedColormap.from_list("pcoa_grad", ["#DDDDDD", ACCENT_LIGHT_COLOR, ACCENT_COLOR]))
+
+#Figuras PCoA já estilizadas, com os pontos da referência desenhados, indexadas pela impressão digital da referência
+_pcoa_templates = LRUCache(maxsize=2)
+
+
+def _style_axes(ax, grid_axis):
+    ax.set_facecolor('#FFFFFF00')
+    ax.tick_params(axis='x', colors=PRIMARY_TEXT_COLOR)
+    ax.tick_params(axis='y', colors=PRIMARY_TEXT_COLOR)
+    ax.grid(axis=grid_axis, linestyle='--', color='grey', alpha=0.5)
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['bottom'].set_color('grey')
+    ax.spines['left'].set_color('grey')
+
+
+#tight_layout já é aplicado na montagem da figura, então o savefig não precisa de bbox_inches='tight' (que desenha a figura duas vezes)
+def _encode_figure(fig, plot_format):
+    buf = io.BytesIO()
+    fig.savefig(buf, format=plot_format, transparent=True)
+    return base64.b64encode(buf.getvalue()).decode('utf-8')
+
+
+#Dados do gráfico de barras (top 10 da amostra), também usados diretamente no modo de saída 'data'
+def top_bacteria_plot_data(target_abund):
+    return {"labels": [str(label) for label in target_abund.index], "values": [float(value) for value in target_abund.values]}
+
+
+#Grafico de abundancia das espécies (top 10 da amostra)
+def render_top_bacteria_plot(plot_data, sample_name, plot_format=PLOT_FORMAT_PNG):
+    import matplotlib.colors as mcolors
+    from matplotlib.figure import Figure
+    bar_cmap = _colormaps()[0]
+    values = np.asarray(plot_data["values"], dtype=float)
+    fig_bar = Figure(figsize=(10, 6), dpi=PLOT_DPI)
+    fig_bar.patch.set_alpha(0.0)
+    ax_bar = fig_bar.add_subplot(111)
+    normalized_values = mcolors.Normalize(values.min(), values.max()) if len(values) else mcolors.Normalize()
+
+    ax_bar.bar([l.replace('_', ' ').replace(' ', '\n') for l in plot_data["labels"]],
+               values,
+               color=bar_cmap(normalized_values(values)),
+               edgecolor=PRIMARY_TEXT_COLOR,
+               linewidth=0.5)
+
+    ax_bar.set_title(f'Top 10 Bactérias - {sample_name}', color=PRIMARY_TEXT_COLOR, fontweight='bold', fontsize=14)
+    ax_bar.set_ylabel('Abundância Relativa', color=PRIMARY_TEXT_COLOR, fontsize=12)
+    _style_axes(ax_bar, 'y')
+    ax_bar.tick_params(axis='x', rotation=45)
+
+    fig_bar.tight_layout()
+    return _encode_figure(fig_bar, plot_format)
+
+
+class _PcoaTemplate:
+    """
+    Figura PCoA de uma referência: eixos, estilo, pontos da referência, legenda e barra de cores são montados uma vez.
+    Para cada amostra alvo apenas o ponto projetado (e o anel de destaque) é adicionado, salvo e removido.
+    A escala de cores é fixada pelas idades da referência; idades preditas fora da faixa usam a cor do extremo.
+    """
+
+    def __init__(self, reference_coords, ages_ref):
+        import matplotlib.colors as mcolors
+        from matplotlib.figure import Figure
+        from matplotlib.lines import Line2D
+        self.cmap = _colormaps()[1]
+        self.fig = Figure(figsize=(8, 8), dpi=PLOT_DPI)
+        self.fig.patch.set_alpha(0.0)
+        ax = self.ax = self.fig.add_subplot(111)
+        self.norm = mcolors.Normalize(float(np.min(ages_ref)), float(np.max(ages_ref)))
+
+        scatter = ax.scatter(reference_coords[:, 0], reference_coords[:, 1], c=ages_ref, cmap=self.cmap, norm=self.norm,
+                             alpha=0.8, s=60, edgecolor='#FFFFFF', linewidth=0.5)
+        ax.set_title('Análise de Similaridade da Microbiota (PCoA)', color=PRIMARY_TEXT_COLOR, fontweight='bold', fontsize=14)
+        ax.set_xlabel('Componente Principal 1', color=PRIMARY_TEXT_COLOR, fontsize=12)
+        ax.set_ylabel('Componente Principal 2', color=PRIMARY_TEXT_COLOR, fontsize=12)
+        _style_axes(ax, 'both')
+
+        target_handle = Line2D([], [], linestyle='none', marker='o', markersize=14, markerfacecolor='none',
+                               markeredgecolor=PRIMARY_TEXT_COLOR, markeredgewidth=2)
+        legend = ax.legend([target_handle], ['Indivíduo Alvo'])
+        for text in legend.get_texts():
+            text.set_color(PRIMARY_TEXT_COLOR)
+
+        cbar = self.fig.colorbar(scatter, ax=ax, fraction=0.046, pad=0.04)
+        cbar.set_label('Idade em Meses (Real ou Predita)', color=PRIMARY_TEXT_COLOR, fontsize=12)
+        cbar.ax.yaxis.set_tick_params(color=PRIMARY_TEXT_COLOR)
+        for label in cbar.ax.get_yticklabels():
+            label.set_color(PRIMARY_TEXT_COLOR)
+
+        #Os limites dos eixos são fixados pela referência, para que todos os gráficos do lote usem a mesma escala
+        self._reference_limits = (ax.get_xlim(), ax.get_ylim())
+        self.fig.tight_layout()
+        #A figura é compartilhada entre as requisições (threads) do mesmo processo
+        self._lock = threading.Lock()
+
+    def render(self, target_coords, age_target_predicted, plot_format):
+        ax = self.ax
+        x, y = float(target_coords[0]), float(target_coords[1])
+        with self._lock:
+            #Amostras projetadas fora da nuvem da referência ampliam os eixos apenas no seu próprio gráfico
+            ax.set_xlim(*_expand_limits(self._reference_limits[0], x))
+            ax.set_ylim(*_expand_limits(self._reference_limits[1], y))
+            artists = [
+                ax.scatter([x], [y], c=[age_target_predicted], cmap=self.cmap, norm=self.norm, alpha=0.8, s=60, edgecolor='#FFFFFF', linewidth=0.5),
+                ax.scatter([x], [y], facecolors='none', edgecolors=PRIMARY_TEXT_COLOR, s=200, linewidth=2),
+            ]
+            try:
+                return _encode_figure(self.fig, plot_format)
+            finally:
+                for artist in artists:
+                    artist.remove()
+
+
+#Amplia os limites de um eixo (com margem de 5%) quando o valor da amostra alvo fica fora deles
+def _expand_limits(limits, value):
+    low, high = limits
+    margin = 0.05 * (high - low)
+    return min(low, value - margin), max(high, value + margin)
+
+
+#Gráfico PCoA (beta - diversidade): referência nos eixos fixos e a amostra alvo projetada em destaque
+def render_pcoa_plot(reference_key, reference_coords, ages_ref, target_coords, age_target_predicted, plot_format=PLOT_FORMAT_PNG):
+    template = _pcoa_templates.get(reference_key)
+    if template is None:
+        template = _pcoa_templates[reference_key] = _PcoaTemplate(np.asarray(reference_coords), np.asarray(ages_ref))
+    return template.render(target_coords, age_target_predicted, plot_format)
+
+
+#Carrega o matplotlib, o backend de rasterização e as fontes antes da primeira requisição (aquecimento opcional do servidor)
+def warm_up_fonts():
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(2, 2), dpi=PLOT_DPI)
+    ax = fig.add_subplot(111)
+    ax.set_title('Aquecimento', fontweight='bold')
+    ax.set_xlabel('Componente Principal 1')
+    fig.savefig(io.BytesIO(), format=PLOT_FORMAT_PNG)
+    _colormaps()
+
+
+#Renderiza os dois gráficos de uma amostra. `task` contém apenas dados simples, para poder ser enviada a outro processo.
+#O tempo de cada gráfico volta em 'render_seconds', já que a renderização pode ocorrer em outro processo.
+def render_sample_plots(task):
+    plot_format = task["plot_format"]
+    start = time.perf_counter()
+    result = {"top_bacteria_plot_url": render_top_bacteria_plot(task["top_bacteria"], task["sample_name"], plot_format)}
+    render_seconds = {"top_bacteria": time.perf_counter() - start}
+    pcoa_plot_url = None
+    try:
+        if task["target_coords"] is not None:
+            start = time.perf_counter()
+            pcoa_plot_url = render_pcoa_plot(task["reference_key"], task["reference_coords"], task["ages_ref"],
+                                             task["target_coords"], task["age_predicted"], plot_format)
+            render_seconds["pcoa"] = time.perf_counter() - start
+    except Exception as e:
+        print(f"ERRO AO GERAR GRÁFICO PCOA para {task['sample_name']}: {e}")
+    result["pcoa_plot_url"] = pcoa_plot_url
+    result["render_seconds"] = render_seconds
+    return result
+
+
+#Cada processo do pool mantém seus próprios templates de figura; o cache é reaproveitado entre lotes da mesma referência
+def _render_sample_plots_batch(tasks):
+    return [render_sample_plots(task) for task in tasks]
+
+
+class PlotRenderer:
+    """
+    Etapa de renderização dos gráficos. Lotes com várias amostras são distribuídos em um pool de processos
+    (matplotlib é limitado pelo GIL); lotes pequenos, ou `max_workers` <= 1, são renderizados no próprio processo.
+    """
+
+    def __init__(self, max_workers=2, min_parallel_samples=4):
+        self.max_workers = max_workers
+        self.min_parallel_samples = min_parallel_samples
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                #'spawn' pelos mesmos motivos da fila de análises: não herdar threads e locks do servidor
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def submit(self, tasks):
+        """Agenda a renderização de uma lista de tarefas e retorna um Future por tarefa, na mesma ordem."""
+        if self.max_workers <= 1 or len(tasks) < self.min_parallel_samples:
+            return [_InlineRenderFuture(task) for task in tasks]
+        #As tarefas são agrupadas em um bloco por processo, para que cada processo monte o template PCoA uma só vez por lote
+        chunk_size = -(-len(tasks) // self.max_workers)
+        executor = self._get_executor()
+        futures = []
+        for start in range(0, len(tasks), chunk_size):
+            chunk_future = executor.submit(_render_sample_plots_batch, tasks[start:start + chunk_size])
+            futures.extend(_chunk_item_future(chunk_future, index) for index in range(len(tasks[start:start + chunk_size])))
+        return futures
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+#Future renderizado no próprio processo apenas quando o resultado é pedido, para que cada amostra seja entregue
+#logo após o seu próprio gráfico, sem esperar os demais do lote
+class _InlineRenderFuture(Future):
+    def __init__(self, task):
+        super().__init__()
+        self._task = task
+        self._render_lock = threading.Lock()
+
+    def result(self, timeout=None):
+        with self._render_lock:
+            if not self.done():
+                try:
+                    self.set_result(render_sample_plots(self._task))
+                except Exception as e:
+                    self.set_exception(e)
+                self._task = None
+        return super().result(timeout)
+
+
+#Future de um item de um bloco renderizado em outro processo
+def _chunk_item_future(chunk_future, index):
+    future = Future()
+    def resolve(done):
+        error = done.exception()
+        if error is not None: future.set_exception(error)
+        else: future.set_result(done.result()[index])
+    chunk_future.add_done_callback(resolve)
+    return future
@@ -0,0 +1,145 @@
+import base64
+import json
+import os
+import re
+
+import numpy as np
+
+#Tipos de registro do fluxo de resultados (uma linha NDJSON por registro, com o campo "type")
+RECORD_ANALYSIS = "analysis"
+RECORD_SAMPLE = "sample"
+RECORD_SUMMARY = "summary"
+RECORD_ERROR = "error"
+
+#Modo das imagens na API: gravadas em disco e referenciadas por id, embutidas em base64, ou omitidas (apenas dados dos gráficos)
+IMAGES_REF = "ref"
+IMAGES_INLINE = "inline"
+IMAGES_NONE = "none"
+IMAGE_MODES = (IMAGES_REF, IMAGES_INLINE, IMAGES_NONE)
+
+#Campos das figuras em base64 nos registros de amostra -> nome da figura
+FIGURE_FIELDS = {"top_bacteria_plot_url": "top_bacteria", "pcoa_plot_url": "pcoa"}
+
+_SAFE_ID = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+#Escalares e arrays do numpy (ex.: predições float32) viram tipos nativos do JSON
+def _json_default(value):
+    if isinstance(value, np.generic): return value.item()
+    if isinstance(value, np.ndarray): return value.tolist()
+    raise TypeError(f"Objeto do tipo {type(value).__name__} não é serializável em JSON")
+
+
+def dumps_record(record_type, payload):
+    """Uma linha NDJSON compacta (sem indentação) com o tipo do registro e seus campos."""
+    return json.dumps({"type": record_type, **payload}, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+
+
+class NdjsonWriter:
+    """
+    Arquivo NDJSON apenas de acréscimo: cada registro é gravado e descarregado no disco assim que é produzido,
+    sem manter o documento inteiro em memória nem regravá-lo a cada amostra.
+    """
+
+    def __init__(self, path):
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder): os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write_line(self, line):
+        self._file.write(line + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_ndjson_records(path):
+    """Lê um arquivo NDJSON linha a linha, produzindo (tipo, campos). Linhas incompletas (análise interrompida) são ignoradas."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip(): continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            yield record.pop("type", None), record
+
+
+def load_ndjson_results(path):
+    """Reconstrói o documento de resultados (mesmo formato do JSON do laudo) a partir de um arquivo NDJSON."""
+    results, samples = None, []
+    for record_type, record in iter_ndjson_records(path):
+        if record_type == RECORD_ANALYSIS:
+            results = record
+        elif record_type == RECORD_SAMPLE:
+            record.pop("index", None)
+            samples.append(record)
+        elif record_type == RECORD_SUMMARY and results is not None:
+            results["timings"] = record.get("timings")
+        elif record_type == RECORD_ERROR and results is not None:
+            results.setdefault("errors", []).append(record.get("error"))
+    if results is None: raise ValueError(f"O arquivo '{path}' não contém o registro inicial da análise.")
+    results["individual_analyses"] = samples
+    return results
+
+
+class FigureStore:
+    """Figuras das análises da API, gravadas em `folder/<id da análise>/` e referenciadas por id nos registros NDJSON."""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def save(self, analysis_id, sample_index, figure_name, encoded, plot_format):
+        folder = os.path.join(self.folder, analysis_id)
+        if not os.path.exists(folder): os.makedirs(folder, exist_ok=True)
+        figure_id = f"{sample_index:05d}_{figure_name}.{plot_format}"
+        with open(os.path.join(folder, figure_id), 'wb') as f:
+            f.write(base64.b64decode(encoded))
+        return figure_id
+
+    def path(self, analysis_id, figure_id):
+        """Caminho da figura, ou None se o id for inválido ou a figura não existir."""
+        if not _SAFE_ID.match(analysis_id) or not _SAFE_ID.match(figure_id) or figure_id.startswith("."): return None
+        path = os.path.join(self.folder, analysis_id, figure_id)
+        return path if os.path.isfile(path) else None
+
+
+def stream_ndjson(records, output_path, analysis_id, images=IMAGES_REF, figure_store=None, plot_format=None):
+    """
+    Converte os registros de uma análise (pares tipo/campos) em linhas NDJSON. Cada linha é acrescentada ao arquivo de saída
+    antes de ser enviada; no modo IMAGES_REF as figuras vão para o `figure_store` e o registro guarda apenas seus ids.
+    Falhas durante a análise viram um registro de erro, já que o cabeçalho HTTP foi enviado.
+    """
+    sample_index = 0
+    with NdjsonWriter(output_path) as writer:
+        try:
+            for record_type, payload in records:
+                if record_type == RECORD_ANALYSIS:
+                    payload = dict(payload, analysis_id=analysis_id)
+                elif record_type == RECORD_SAMPLE:
+                    payload = dict(payload, index=sample_index)
+                    if images == IMAGES_REF and figure_store is not None and "error" not in payload:
+                        figures = {}
+                        for field, figure_name in FIGURE_FIELDS.items():
+                            encoded = payload.pop(field, None)
+                            if encoded: figures[figure_name] = figure_store.save(analysis_id, sample_index, figure_name, encoded, plot_format)
+                        payload["figures"] = figures
+                    sample_index += 1
+                line = dumps_record(record_type, payload)
+                writer.write_line(line)
+                yield line + "\n"
+        except Exception as e:
+            print(f"ERRO: Falha durante a análise em streaming {analysis_id}: {e}")
+            line = dumps_record(RECORD_ERROR, {"error": f"Erro inesperado durante a análise: {e}"})
+            writer.write_line(line)
+            yield line + "\n"
+        finally:
+            records.close()
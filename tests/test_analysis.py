@@ -0,0 +1,62 @@
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from werkzeug.datastructures import FileStorage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analysis
+from insights import InsightPipeline
+
+SPECIES = [f"s__Especie_{index}" for index in range(8)]
+
+
+def _upload(frame, filename):
+    return FileStorage(stream=io.BytesIO(frame.to_csv(index=False).encode('utf-8')), filename=filename)
+
+
+def _abundances(rows, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(rng.integers(0, 50, size=(rows, len(SPECIES))), columns=SPECIES)
+
+
+class ReferenceWithSampleIdTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        analysis.init_analysis_services({
+            'UPLOAD_FOLDER': os.path.join(self._tmp.name, 'uploads'),
+            'MODEL_CACHE_FOLDER': os.path.join(self._tmp.name, 'model_cache'),
+            'INSIGHT_CACHE_PATH': os.path.join(self._tmp.name, 'insights.sqlite3'),
+            'PLOT_FORMAT': 'data',
+            'PLOT_MAX_WORKERS': 0,
+            'TRAINING_N_JOBS': 1,
+        })
+        #Sem clientes das APIs externas: o insight cai no texto de indisponibilidade, sem rede
+        analysis.insight_pipeline = InsightPipeline(max_workers=1, rate_limiter=None, cache=None)
+
+    def tearDown(self):
+        analysis.plot_renderer.shutdown()
+        self._tmp.cleanup()
+
+    def test_sample_id_column_is_not_a_species(self):
+        reference = _abundances(20, seed=0)
+        reference.insert(0, "sample_id", [f"S{row}" for row in range(len(reference))])
+        reference["age_months"] = np.linspace(1, 24, len(reference))
+        reference["body_weight"] = np.linspace(3, 12, len(reference))
+        self.assertEqual(analysis.reference_species_columns(reference), SPECIES)
+        self.assertEqual(analysis.reference_species_columns(reference.rename(columns={"sample_id": "Unnamed: 0"})), SPECIES)
+
+        results = analysis.run_analysis(_upload(reference, "referencia.csv"), [_upload(_abundances(1, seed=1), "alvo.csv")])
+        sample = results["individual_analyses"][0]
+        self.assertNotIn("error", sample)
+        self.assertTrue(sample["similar_samples"])
+        self.assertTrue(all(neighbor["reference_sample"].startswith("S") for neighbor in sample["similar_samples"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
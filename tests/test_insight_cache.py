@@ -0,0 +1,42 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from insight_cache import InsightCache
+
+TOP_3 = ["s__Bacteroides_fragilis", "s__Prevotella_copri", "s__Escherichia_coli"]
+VALUE = {"query": "q", "summaries": [], "insight": "Insight."}
+
+
+class InsightCacheTtlTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self._tmp.name, "insights.sqlite3")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_disk_hit_keeps_the_original_expiry(self):
+        InsightCache(self.db_path, ttl_seconds=1.0).set(TOP_3, VALUE)
+        time.sleep(0.6)
+        #Novo processo: a entrada vem do disco para a memória perto do fim da validade
+        cache = InsightCache(self.db_path, ttl_seconds=1.0)
+        self.assertEqual(cache.get(TOP_3), VALUE)
+        time.sleep(0.6)
+        self.assertIsNone(cache.get(TOP_3))
+
+    def test_expired_rows_are_purged_on_start_up(self):
+        InsightCache(self.db_path, ttl_seconds=0.2).set(TOP_3, VALUE)
+        time.sleep(0.3)
+        InsightCache(self.db_path, ttl_seconds=0.2)
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM insights").fetchone()[0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
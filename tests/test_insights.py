@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from insight_cache import InsightCache
+from insights import InsightPipeline
+from metrics import registry as metrics_registry
+
+TOP_3 = ["s__Bacteroides_fragilis", "s__Prevotella_copri", "s__Escherichia_coli"]
+
+
+#Clientes locais (stubs) no lugar do Gemini e do NCBI; `fail` faz a chamada correspondente lançar uma exceção
+class StubLLM:
+    def __init__(self, fail_query=False):
+        self.fail_query = fail_query
+        self.prompts = []
+
+    def generate(self, prompt):
+        self.prompts.append(prompt)
+        if "consulta PubMed" in prompt:
+            if self.fail_query: raise RuntimeError("503 Service Unavailable")
+            return "(Bacteroides) AND gut microbiota"
+        return "Insight gerado."
+
+
+class StubPubMed:
+    def __init__(self, fail_search=False, fetch_delay=0.0):
+        self.fail_search = fail_search
+        self.fetch_delay = fetch_delay
+
+    def esearch(self, query, max_articles):
+        if self.fail_search: raise RuntimeError("esearch indisponível")
+        return {"IdList": ["1"]}
+
+    def efetch(self, id_list):
+        time.sleep(self.fetch_delay)
+        return {"PubmedArticle": [{"MedlineCitation": {"Article": {"ArticleTitle": "Título do artigo",
+                                                                   "Abstract": {"AbstractText": ["Resumo do artigo"]}}}}]}
+
+
+class InsightPipelineCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.cache = InsightCache(os.path.join(self._tmp.name, "insights.sqlite3"))
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _generate(self, llm_client, pubmed_client, call_timeout=5.0):
+        pipeline = InsightPipeline(max_workers=1, call_timeout=call_timeout, llm_client=llm_client, pubmed_client=pubmed_client,
+                                   rate_limiter=None, cache=self.cache)
+        return pipeline.generate_insights([("amostra", TOP_3)])[0]
+
+    def test_complete_result_is_cached(self):
+        self.assertEqual(self._generate(StubLLM(), StubPubMed()), "Insight gerado.")
+        cached = self.cache.get(TOP_3)
+        self.assertIsNotNone(cached)
+        self.assertEqual(len(cached["summaries"]), 1)
+
+    def test_abstracts_reach_the_summary_prompt(self):
+        llm_client = StubLLM()
+        self._generate(llm_client, StubPubMed())
+        self.assertIn("Título do artigo", llm_client.prompts[-1])
+        self.assertIn("Resumo do artigo", llm_client.prompts[-1])
+
+    def test_failed_query_is_not_cached(self):
+        self.assertEqual(self._generate(StubLLM(fail_query=True), StubPubMed()), "Insight gerado.")
+        self.assertIsNone(self.cache.get(TOP_3))
+
+    def test_failed_search_is_not_cached(self):
+        self.assertEqual(self._generate(StubLLM(), StubPubMed(fail_search=True)), "Insight gerado.")
+        self.assertIsNone(self.cache.get(TOP_3))
+
+    def test_fetch_timeout_is_not_cached_and_uses_efetch_label(self):
+        self.assertEqual(self._generate(StubLLM(), StubPubMed(fetch_delay=0.5), call_timeout=0.1), "Insight gerado.")
+        self.assertIsNone(self.cache.get(TOP_3))
+        self.assertIn('microbiota_external_call_errors_total{kind="timeout",operation="efetch",service="pubmed"}',
+                      metrics_registry.render())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import KFold, train_test_split
+
+N_ESTIMATORS = 100
+RANDOM_STATE = 42
+
+
+def _forest(n_jobs):
+    return RandomForestRegressor(n_estimators=N_ESTIMATORS, random_state=RANDOM_STATE, n_jobs=n_jobs)
+
+
+class ReferenceModels:
+    """
+    Modelos preditivos das variáveis alvo de uma referência.
+    Quando todas as variáveis estão presentes em todas as amostras, uma única floresta multi-saída é treinada, com os alvos
+    padronizados para que idade e peso pesem igualmente nas divisões; caso contrário, uma floresta por variável, cada uma
+    com as amostras em que a variável existe. As árvores são construídas em paralelo (`n_jobs`).
+    """
+
+    def __init__(self, targets, n_jobs=None):
+        self.targets = list(targets)
+        self.n_jobs = n_jobs
+        self.multi_output = False
+        self.forest = None
+        self.forests = {}
+        self._mean = None
+        self._scale = None
+
+    def fit(self, X, Y):
+        Y = np.asarray(Y, dtype=float).reshape(X.shape[0], len(self.targets))
+        present = ~np.isnan(Y)
+        self.multi_output = len(self.targets) > 1 and bool(present.all())
+        if self.multi_output:
+            self._mean = Y.mean(axis=0)
+            scale = Y.std(axis=0)
+            self._scale = np.where(scale > 0, scale, 1.0)
+            self.forest = _forest(self.n_jobs).fit(X, (Y - self._mean) / self._scale)
+            return self
+        for column, target in enumerate(self.targets):
+            rows = np.flatnonzero(present[:, column])
+            if len(rows) == 0: raise ValueError(f"A variável {target} não tem valores na base de referência.")
+            self.forests[target] = _forest(self.n_jobs).fit(X[rows], Y[rows, column])
+        return self
+
+    def predict(self, X):
+        """Predições de todas as variáveis alvo em uma passada: dict variável -> array."""
+        if self.multi_output:
+            #A média das folhas é linear, então desfazer a padronização após a predição é exato
+            Y = self.forest.predict(X).reshape(X.shape[0], len(self.targets)) * self._scale + self._mean
+            return {target: Y[:, column] for column, target in enumerate(self.targets)}
+        return {target: forest.predict(X) for target, forest in self.forests.items()}
+
+
+#Treina em `train_rows` e calcula R2/MAE de cada variável em `test_rows` (amostras sem o valor real são ignoradas)
+def _fit_and_score(X, Y, targets, train_rows, test_rows, n_jobs):
+    models = ReferenceModels(targets, n_jobs).fit(X[train_rows], Y[train_rows])
+    predictions = models.predict(X[test_rows])
+    scores = {}
+    for column, target in enumerate(targets):
+        y_test = Y[test_rows, column]
+        present = ~np.isnan(y_test)
+        if not present.any(): continue
+        y_test, y_pred = y_test[present], predictions[target][present]
+        r2 = r2_score(y_test, y_pred) if len(np.unique(y_test)) > 1 else 0.0
+        scores[target] = {"R2": float(r2), "MAE": float(mean_absolute_error(y_test, y_pred))}
+    return scores
+
+
+def evaluate_holdout(X, Y, targets, n_jobs=None):
+    """Avaliação com uma única divisão 80/20 (uma amostra de teste em referências com menos de 5 amostras)."""
+    n_samples = X.shape[0]
+    test_size = 0.2 if n_samples >= 5 else (1 / n_samples)
+    train_rows, test_rows = train_test_split(np.arange(n_samples), test_size=test_size, random_state=RANDOM_STATE)
+    return _fit_and_score(X, Y, targets, train_rows, test_rows, n_jobs)
+
+
+def cross_validate(X, Y, targets, folds, n_jobs=None):
+    """
+    Validação cruzada k-fold. Os folds rodam em paralelo (um processo por fold, cada floresta com um único núcleo)
+    e o resultado traz a média das métricas em "R2"/"MAE", com desvio padrão e variância entre os folds.
+    """
+    folds = min(folds, X.shape[0])
+    splits = KFold(n_splits=folds, shuffle=True, random_state=RANDOM_STATE).split(np.arange(X.shape[0]))
+    fold_scores = Parallel(n_jobs=n_jobs)(delayed(_fit_and_score)(X, Y, targets, train_rows, test_rows, 1)
+                                          for train_rows, test_rows in splits)
+    performance = {}
+    for target in targets:
+        scores = [fold[target] for fold in fold_scores if target in fold]
+        if not scores: continue
+        performance[target] = {"folds": len(scores)}
+        for metric in ("R2", "MAE"):
+            values = np.array([score[metric] for score in scores])
+            performance[target].update({metric: float(values.mean()), f"{metric}_std": float(values.std()),
+                                        f"{metric}_var": float(values.var())})
+    return performance
+
+
+def train_models(X, Y, targets, n_jobs=None, cv_folds=0):
+    """
+    Avalia (holdout 80/20, ou k-fold com `cv_folds` >= 2) e treina os modelos finais com todas as amostras da referência.
+    Retorna (ReferenceModels, métricas de desempenho por variável).
+    """
+    Y = np.asarray(Y, dtype=float).reshape(X.shape[0], len(targets))
+    if cv_folds >= 2:
+        performance_metrics = cross_validate(X, Y, targets, cv_folds, n_jobs)
+    else:
+        performance_metrics = evaluate_holdout(X, Y, targets, n_jobs)
+    return ReferenceModels(targets, n_jobs).fit(X, Y), performance_metrics